@@ -0,0 +1,157 @@
+"""
+Analytics queries for the admin dashboard
+Counts come from the pre-aggregated session_rollups table (see rollups.py);
+only the duration percentiles read raw sessions, limited to the chosen range.
+Postgres and SQLite spell date arithmetic differently, so the dialect-specific
+pieces are built here.
+"""
+
+import math
+from datetime import timedelta
+from sqlalchemy import func, cast, Float
+from models import db, Conclusion, TroubleshootingSession, SessionRollup
+from session_steps import step_counts
+
+# Completed-session duration percentiles shown on the dashboard
+DURATION_PERCENTILES = (0.5, 0.9, 0.99)
+
+def _dialect():
+    return db.engine.dialect.name
+
+def duration_seconds(started, completed):
+    """SQL expression for completed - started in seconds"""
+    if _dialect() == 'postgresql':
+        return cast(func.extract('epoch', completed - started), Float)
+    return (func.julianday(completed) - func.julianday(started)) * 86400.0
+
+def _rollup_range(grain, start, end):
+    """Criteria selecting rollup rows of one grain inside [start, end)"""
+    criteria = [SessionRollup.grain == grain]
+    if start:
+        criteria.append(SessionRollup.bucket >= start)
+    if end:
+        criteria.append(SessionRollup.bucket < end)
+    return criteria
+
+def session_totals(start=None, end=None):
+    """Total, completed, abandoned and average path length from the daily rollups"""
+    r = SessionRollup
+    total, completed, abandoned, questions = db.session.query(
+        func.coalesce(func.sum(r.sessions_started), 0),
+        func.coalesce(func.sum(r.sessions_completed), 0),
+        func.coalesce(func.sum(r.sessions_abandoned), 0),
+        func.coalesce(func.sum(r.total_questions), 0)
+    ).filter(*_rollup_range('day', start, end)).one()
+    return {
+        'total_sessions': total,
+        'completed_sessions': completed,
+        'abandoned_sessions': abandoned,
+        'avg_questions': round(questions / completed, 1) if completed else 0
+    }
+
+def duration_percentiles(*criteria, percentiles=DURATION_PERCENTILES):
+    """Map of percentile -> completed-session duration in seconds (None if no data)"""
+    s = TroubleshootingSession
+    duration = duration_seconds(s.started_at, s.completed_at)
+    criteria = (s.completed_at.isnot(None),) + criteria
+
+    if _dialect() == 'postgresql':
+        row = db.session.query(*[
+            func.percentile_cont(p).within_group(duration) for p in percentiles
+        ]).filter(*criteria).one()
+        return {p: (float(v) if v is not None else None) for p, v in zip(percentiles, row)}
+
+    # No percentile_cont elsewhere: fetch the two neighbouring rows and interpolate
+    count = db.session.query(func.count(s.id)).filter(*criteria).scalar()
+    result = {}
+    for p in percentiles:
+        if not count:
+            result[p] = None
+            continue
+        rank = p * (count - 1)
+        values = [v for (v,) in db.session.query(duration).filter(*criteria)
+                  .order_by(duration).offset(math.floor(rank)).limit(2)]
+        low = values[0]
+        high = values[-1]
+        result[p] = low + (high - low) * (rank - math.floor(rank))
+    return result
+
+def top_conclusions(start=None, end=None, limit=10):
+    """Most frequently reached conclusions with their counts"""
+    r = SessionRollup
+    count = func.sum(r.sessions_completed)
+    # Group on the integer id; only the top few texts are joined in
+    top = db.session.query(
+        r.conclusion_id,
+        count.label('count')
+    ).filter(
+        r.conclusion_id != 0, *_rollup_range('day', start, end)
+    ).group_by(
+        r.conclusion_id
+    ).order_by(
+        count.desc()
+    ).limit(limit).subquery()
+    return db.session.query(
+        Conclusion.text,
+        top.c.count
+    ).join(
+        top, top.c.conclusion_id == Conclusion.id
+    ).order_by(
+        top.c.count.desc()
+    ).all()
+
+def category_breakdown(start=None, end=None):
+    """Completed sessions per first-level category"""
+    r = SessionRollup
+    count = func.sum(r.sessions_completed)
+    return db.session.query(
+        r.category,
+        count.label('count')
+    ).filter(
+        r.category != '', *_rollup_range('day', start, end)
+    ).group_by(
+        r.category
+    ).order_by(
+        count.desc()
+    ).all()
+
+def session_series(start=None, end=None):
+    """Started/completed/abandoned counts per bucket of start time, hourly for short ranges"""
+    r = SessionRollup
+    grain = 'hour' if start and end and end - start <= timedelta(days=2) else 'day'
+    return grain, db.session.query(
+        r.bucket,
+        func.sum(r.sessions_started).label('started'),
+        func.sum(r.sessions_completed).label('completed'),
+        func.sum(r.sessions_abandoned).label('abandoned')
+    ).filter(
+        *_rollup_range(grain, start, end)
+    ).group_by(
+        r.bucket
+    ).order_by(
+        r.bucket.desc()
+    ).all()
+
+def recent_sessions(limit=20):
+    """Most recently started sessions"""
+    return TroubleshootingSession.query.order_by(
+        TroubleshootingSession.started_at.desc()
+    ).limit(limit).all()
+
+def dashboard_metrics(start=None, end=None):
+    """Everything the analytics page shows for sessions in [start, end)"""
+    s = TroubleshootingSession
+    in_range = []
+    if start:
+        in_range.append(s.started_at >= start)
+    if end:
+        in_range.append(s.started_at < end)
+
+    metrics = session_totals(start, end)
+    metrics['duration_percentiles'] = duration_percentiles(*in_range)
+    metrics['conclusion_stats'] = top_conclusions(start, end)
+    metrics['category_stats'] = category_breakdown(start, end)
+    metrics['series_grain'], metrics['series'] = session_series(start, end)
+    metrics['recent_sessions'] = recent_sessions()
+    metrics['step_counts'] = step_counts([s.session_id for s in metrics['recent_sessions']])
+    return metrics
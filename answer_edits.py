@@ -0,0 +1,142 @@
+"""
+Batch answer edits
+The question editor saves a new answer order and any changed answers in one
+request, applied with a single bulk UPDATE, instead of one POST, commit and
+page reload per move. Every change to a question or its answers bumps
+questions.version. A batch names the version it was made against and is
+refused if someone has saved since (optimistic concurrency). Bumping the
+version first also takes the question's row lock until commit, so two admins
+adding answers at once queue up instead of reading the same max(order).
+"""
+
+from sqlalchemy import case, update
+from models import db, Question, Answer
+import conclusions
+
+def claim(question_id, expected_version=None):
+    """Bump a question's version in the caller's transaction
+
+    Returns False if the question is gone or, when expected_version is given,
+    has been changed since that version.
+    """
+    statement = update(Question).where(Question.id == question_id).values(version=Question.version + 1)
+    if expected_version is not None:
+        statement = statement.where(Question.version == expected_version)
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount == 1
+
+def next_order(question_id):
+    """Display position after a question's last answer; call claim() first"""
+    return (db.session.query(db.func.max(Answer.order)).filter_by(question_id=question_id).scalar() or 0) + 1
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_batch(payload):
+    """(version, order, edits) from a batch request body, or ValueError
+
+    The body is {"version": n, "order": [answer ids], "answers": [{"id": ...,
+    "text": ..., "next_question_id": ..., "conclusion": ...}]}. order and
+    answers are optional, as is every answer field but id.
+    """
+    if not isinstance(payload, dict) or not _is_id(payload.get('version')):
+        raise ValueError('expected {"version": n, "order": [...], "answers": [...]}')
+    order = payload.get('order')
+    if order is not None and (not isinstance(order, list) or not all(_is_id(i) for i in order)
+                              or len(set(order)) != len(order)):
+        raise ValueError('order must list answer ids, each once')
+    items = payload.get('answers') or []
+    if not isinstance(items, list):
+        raise ValueError('answers must be a list')
+
+    edits = {}
+    for item in items:
+        if not isinstance(item, dict) or not _is_id(item.get('id')) or item['id'] in edits:
+            raise ValueError('each edited answer needs a unique id')
+        changes = {}
+        if 'text' in item:
+            if not isinstance(item['text'], str) or not item['text'].strip():
+                raise ValueError(f'answer {item["id"]} needs text')
+            changes['text'] = item['text']
+        for field in ('next_question_id', 'conclusion'):
+            if field in item:
+                value = item[field]
+                if value is not None and not isinstance(value, str):
+                    raise ValueError(f'{field} of answer {item["id"]} must be a string or null')
+                if field == 'next_question_id' and value:
+                    value = value.strip()
+                changes[field] = value or None
+        edits[item['id']] = changes
+    return payload['version'], order, edits
+
+def apply_batch(question_id, version, order, edits):
+    """Apply a parsed batch in the caller's transaction
+
+    Returns the number of answers changed, or None if the question has changed
+    since version (or no longer exists). Raises ValueError for orders and edits
+    that don't fit the question; the caller rolls back either way.
+    """
+    if not claim(question_id, version):
+        return None
+    current = {row.id: row for row in db.session.query(
+        Answer.id, Answer.order, Answer.text, Answer.next_question_id, Answer.conclusion_id
+    ).filter(Answer.question_id == question_id)}
+
+    if order is not None and set(order) != current.keys():
+        raise ValueError('order must list every answer of the question exactly once')
+    stray = edits.keys() - current.keys()
+    if stray:
+        raise ValueError(f'answer {min(stray)} does not belong to this question')
+
+    targets = {c['next_question_id'] for c in edits.values() if c.get('next_question_id')}
+    if targets:
+        found = {q for (q,) in db.session.query(Question.question_id).filter(Question.question_id.in_(targets))}
+        missing = targets - found
+        if missing:
+            raise ValueError(f'Question "{min(missing)}" does not exist')
+    conclusion_ids = conclusions.ids_for({c['conclusion'] for c in edits.values() if c.get('conclusion')})
+
+    # column -> {answer id: new value}, only for values that actually change
+    changes = {}
+    for position, answer_id in enumerate(order or [], start=1):
+        if current[answer_id].order != position:
+            changes.setdefault('order', {})[answer_id] = position
+    for answer_id, fields in edits.items():
+        for field, value in fields.items():
+            if field == 'conclusion':
+                field, value = 'conclusion_id', conclusion_ids.get(value)
+            if getattr(current[answer_id], field) != value:
+                changes.setdefault(field, {})[answer_id] = value
+    if not changes:
+        return 0
+
+    changed = set().union(*changes.values())
+    columns = Answer.__table__.c
+    db.session.execute(
+        update(Answer)
+        .where(Answer.question_id == question_id, Answer.id.in_(changed))
+        .values({
+            columns[field]: case(values, value=Answer.id, else_=columns[field])
+            for field, values in changes.items()
+        })
+        .execution_options(synchronize_session=False)
+    )
+    return len(changed)
+
+def question_state(question_id):
+    """JSON-ready question version and ordered answers, or None if it doesn't exist"""
+    question = db.session.get(Question, question_id)
+    if question is None:
+        return None
+    answers = Answer.query.filter_by(question_id=question_id).order_by(Answer.order, Answer.id)
+    return {
+        'id': question.id,
+        'question_id': question.question_id,
+        'version': question.version,
+        'answers': [{
+            'id': answer.id,
+            'order': answer.order,
+            'text': answer.text,
+            'next_question_id': answer.next_question_id,
+            'conclusion': answer.conclusion.text if answer.conclusion else None
+        } for answer in answers]
+    }
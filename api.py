@@ -0,0 +1,281 @@
+"""
+JSON API for the troubleshooting flow
+Serves the compiled tree (or the part of it below one question) so a client can
+fetch it once and walk it locally, then report the session back in one post.
+
+Tree responses carry a strong ETag derived from the tree's content and answer
+If-None-Match with 304 Not Modified. Requesting a tree URL with ?v=<etag> marks
+the response immutable, so it can be cached for a year.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request
+from models import db, TroubleshootingSession
+from tree_cache import tree_cache
+from telemetry import telemetry
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+# Cache-Control for responses whose URL names the tree content they hold
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Most sessions the offline client may upload in one sync post
+SYNC_BATCH_LIMIT = 500
+
+# Longest question or answer text kept from a client-recorded path step
+STEP_TEXT_LIMIT = 1000
+
+def dumps(document):
+    """Compact, deterministic JSON bytes"""
+    return json.dumps(document, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8')
+
+def _question_json(question):
+    return {
+        'text': question.text,
+        'category': question.category or '',
+        'answers': [
+            {
+                'id': answer.id,
+                'text': answer.text,
+                'next': answer.next_question_id,
+                'conclusion': answer.conclusion
+            }
+            for answer in question.answers
+        ]
+    }
+
+def tree_json(tree):
+    """The whole tree in the shape /api/tree returns"""
+    return {
+        'version': tree.version,
+        'start': 'start',
+        'questions': {q.question_id: _question_json(q) for q in tree.questions.values()}
+    }
+
+def content_hash(body):
+    """Hex digest identifying serialized content"""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def subtree(tree, question_id, depth):
+    """question_id and every question up to depth answers below it"""
+    questions = {question_id: tree.get_question(question_id)}
+    frontier = [question_id]
+    for _ in range(depth):
+        reached = []
+        for current in frontier:
+            for answer in questions[current].answers:
+                target = tree.get_question(answer.next_question_id)
+                if target and target.question_id not in questions:
+                    questions[target.question_id] = target
+                    reached.append(target.question_id)
+        if not reached:
+            break
+        frontier = reached
+    return questions
+
+def _error(message, status):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+def _conditional(etag, build_body):
+    """304 if the client already has etag, otherwise the JSON body from build_body()"""
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(build_body(), mimetype='application/json')
+    response.set_etag(etag)
+    if request.args.get('v') == etag:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Always revalidate; an unchanged tree costs one 304
+        response.cache_control.no_cache = True
+    return response
+
+@api.route('/tree')
+def get_tree():
+    """The whole compiled tree"""
+    body, etag = tree_cache.get().document
+    return _conditional(etag, lambda: body)
+
+@api.route('/question/<question_id>')
+def get_question(question_id):
+    """One question, plus ?depth=N levels of the questions below it"""
+    depth = request.args.get('depth', 0, type=int)
+    if depth < 0:
+        return _error('depth must be a non-negative integer', 400)
+
+    tree = tree_cache.get()
+    if not tree.get_question(question_id):
+        return _error(f'Question "{question_id}" not found', 404)
+
+    _, tree_etag = tree.document
+    etag = hashlib.sha256(f'{tree_etag}:{question_id}:{depth}'.encode('utf-8')).hexdigest()[:32]
+    return _conditional(etag, lambda: dumps({
+        'version': tree.version,
+        'question_id': question_id,
+        'questions': {qid: _question_json(q) for qid, q in subtree(tree, question_id, depth).items()}
+    }))
+
+def _parse_time(value):
+    """Naive UTC datetime from an ISO 8601 string, or now if missing/in the future"""
+    now = datetime.utcnow()
+    if not value:
+        return now
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+@api.route('/session/<session_id>/events', methods=['POST'])
+def post_session_events(session_id):
+    """Record a session walked on the client, as one batch of events
+
+    The body is {"events": [...]} where each event is one of
+    {"type": "start", "at": ...}, {"type": "answer", "answer_id": ..., "at": ...} or
+    {"type": "complete", "at": ...}. Every post carries all answers so far,
+    so posts can be repeated or retried safely. Answers and completions are
+    refused for a session whose start hasn't been posted.
+    """
+    if len(session_id) > 100:
+        return _error('session id is too long', 400)
+    payload = request.get_json(silent=True)
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+        return _error('expected {"events": [...]}', 400)
+
+    try:
+        starts = [_parse_time(e.get('at')) for e in events if e.get('type') == 'start']
+        completes = [_parse_time(e.get('at')) for e in events if e.get('type') == 'complete']
+        answers = [(_answer_id(e['answer_id']), _parse_time(e['at']) if e.get('at') else None)
+                   for e in events if e.get('type') == 'answer']
+    except (KeyError, TypeError, ValueError):
+        return _error('events need a valid answer_id and ISO 8601 "at" times', 400)
+
+    tree = tree_cache.get()
+    answer_ids = [answer_id for answer_id, _ in answers]
+    answered_at = {answer_id: at for answer_id, at in answers if at}
+    path = tree.history_for(answer_ids)
+    for step in path:
+        if step['answer_id'] in answered_at:
+            step['at'] = answered_at[step['answer_id']]
+    last = tree.get_answer(answer_ids[-1]) if answer_ids else None
+    if completes and not (last and last.conclusion):
+        return _error('a completed session must end on an answer with a conclusion', 400)
+    if (completes or path) and not starts and not db.session.query(
+        TroubleshootingSession.query.filter_by(session_id=session_id).exists()
+    ).scalar():
+        return _error('post the session\'s start event before its answers', 409)
+
+    if starts:
+        telemetry.session_started(
+            session_id=session_id,
+            started_at=starts[0],
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get('User-Agent', '')[:500]
+        )
+    if completes:
+        telemetry.session_completed(
+            session_id=session_id,
+            completed_at=completes[-1],
+            path=path,
+            conclusion_id=last.conclusion_id
+        )
+    elif path:
+        telemetry.session_progress(session_id, path)
+
+    response = jsonify({'accepted': len(events), 'completed': bool(completes)})
+    response.status_code = 202
+    return response
+
+def _answer_id(value):
+    """An answer id from JSON; true and false are ints to Python, but not ids"""
+    if isinstance(value, bool):
+        raise ValueError('answer_id must be a number')
+    return int(value)
+
+def _path_steps(path, tree):
+    """{question, answer[, answer_id][, at]} steps from a path recorded by a client"""
+    if not isinstance(path, list):
+        raise ValueError('path must be a list')
+    steps = []
+    for step in path:
+        if not isinstance(step.get('question'), str) or not isinstance(step.get('answer'), str):
+            raise ValueError('path steps need question and answer text')
+        clean = {'question': step['question'][:STEP_TEXT_LIMIT], 'answer': step['answer'][:STEP_TEXT_LIMIT]}
+        # Bundles compiled from YAML have no answer ids, and old bundles may name deleted answers
+        answer_id = step.get('answer_id')
+        if isinstance(answer_id, int) and not isinstance(answer_id, bool) and tree.get_answer(answer_id):
+            clean['answer_id'] = step['answer_id']
+        if step.get('at'):
+            clean['at'] = _parse_time(step['at'])
+        steps.append(clean)
+    return steps
+
+@api.route('/sessions/sync', methods=['POST'])
+def sync_sessions():
+    """Record sessions the offline client walked without a connection
+
+    The body is {"sessions": [...]} where each session has session_id,
+    started_at and path (a list of {question, answer, answer_id, at} steps), plus
+    completed_at and conclusion once finished. Repeated uploads are harmless.
+    A session whose conclusion isn't in the current tree is kept unfinished.
+    """
+    payload = request.get_json(silent=True)
+    sessions = payload.get('sessions') if isinstance(payload, dict) else None
+    if not isinstance(sessions, list):
+        return _error('expected {"sessions": [...]}', 400)
+    if len(sessions) > SYNC_BATCH_LIMIT:
+        return _error(f'at most {SYNC_BATCH_LIMIT} sessions per upload', 413)
+
+    # Validate everything before queueing anything, so a retry resends the same batch
+    tree = tree_cache.get()
+    parsed = []
+    for index, item in enumerate(sessions):
+        try:
+            session_id = item['session_id']
+            if not isinstance(session_id, str) or not 0 < len(session_id) <= 100:
+                raise ValueError('bad session_id')
+            conclusion = item.get('conclusion')
+            if conclusion is not None and not isinstance(conclusion, str):
+                raise ValueError('bad conclusion')
+            parsed.append({
+                'session_id': session_id,
+                'started_at': _parse_time(item.get('started_at')),
+                'completed_at': _parse_time(item['completed_at']) if item.get('completed_at') else None,
+                'path': _path_steps(item.get('path') or [], tree),
+                'conclusion': conclusion
+            })
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return _error(f'session {index} is invalid', 400)
+
+    for item in parsed:
+        # Only conclusions already in the tree are recorded; uploaded text never creates one.
+        # Bundles from before an edit may show old wording, so fall back to the last answer's conclusion
+        conclusion_id = tree.conclusion_ids.get(item['conclusion'])
+        if conclusion_id is None and item['path'] and 'answer_id' in item['path'][-1]:
+            conclusion_id = tree.get_answer(item['path'][-1]['answer_id']).conclusion_id
+
+        telemetry.session_started(
+            session_id=item['session_id'],
+            started_at=item['started_at'],
+            ip_address=request.remote_addr,
+            user_agent=request.headers.get('User-Agent', '')[:500]
+        )
+        if item['completed_at'] and conclusion_id:
+            telemetry.session_completed(
+                session_id=item['session_id'],
+                completed_at=item['completed_at'],
+                path=item['path'],
+                conclusion_id=conclusion_id
+            )
+        elif item['path']:
+            telemetry.session_progress(item['session_id'], item['path'])
+
+    response = jsonify({'accepted': len(parsed)})
+    response.status_code = 202
+    return response
@@ -1,8 +1,24 @@
-from flask import Flask, render_template, request, session, redirect, url_for, flash
+from flask import Flask, render_template, request, session, redirect, url_for, flash, jsonify, send_from_directory, abort
 import os
-from models import db, Question, Answer, TroubleshootingSession
+from models import db, Question, Answer, Conclusion, TroubleshootingSession, FunnelEdge, FunnelNode
+from tree_cache import tree_cache, bump_version
+from tree_validation import tree_validator
+from api import api, IMMUTABLE_MAX_AGE, content_hash, dumps
+from telemetry import telemetry
+from metrics import metrics
+from assets import assets
+from startup import startup
+import analytics
+import funnel
+import sweeper
+import bundle
+import retention
+import session_steps
+import search
+import conclusions
+import answer_edits
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY')
@@ -14,12 +30,114 @@ if database_url and database_url.startswith('postgres://'):
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool: pre-ping and recycle drop connections the database (or its
+# pooler) closed while idle, instead of failing the next request that uses them
+engine_options = {
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+}
+if database_url and not database_url.startswith('sqlite'):
+    engine_options.update(
+        pool_size=int(os.environ.get('DB_POOL_SIZE', '5')),
+        max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+        pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    )
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+# Store only answer ids in the session cookie and rebuild the history from the tree
+app.config['COMPACT_SESSION_HISTORY'] = os.environ.get('COMPACT_SESSION_HISTORY', '').lower() in ('1', 'true', 'yes')
+
+# How often each worker checks whether another worker edited the tree
+app.config['TREE_VERSION_CHECK_SECONDS'] = float(os.environ.get('TREE_VERSION_CHECK_SECONDS', '5'))
+
+# Session telemetry is queued and written in batches by a background thread
+app.config['TELEMETRY_ASYNC'] = os.environ.get('TELEMETRY_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+app.config['TELEMETRY_QUEUE_SIZE'] = int(os.environ.get('TELEMETRY_QUEUE_SIZE', '10000'))
+app.config['TELEMETRY_BATCH_SIZE'] = int(os.environ.get('TELEMETRY_BATCH_SIZE', '500'))
+app.config['TELEMETRY_FLUSH_SECONDS'] = float(os.environ.get('TELEMETRY_FLUSH_SECONDS', '1'))
+
+# Unfinished sessions idle this long are marked abandoned by sweeper.py
+app.config['ABANDONED_AFTER_MINUTES'] = int(os.environ.get('ABANDONED_AFTER_MINUTES', '60'))
+app.config['ABANDONED_SWEEP_INTERVAL_SECONDS'] = int(os.environ.get('ABANDONED_SWEEP_INTERVAL_SECONDS', '0'))
+
+# Questions per page on the admin dashboard
+app.config['ADMIN_QUESTIONS_PER_PAGE'] = int(os.environ.get('ADMIN_QUESTIONS_PER_PAGE', '50'))
+
+# Per-request timing: Server-Timing headers (for admins and METRICS_TOKEN holders),
+# a log of slow requests and Prometheus histograms at /metrics, which is only
+# served when METRICS_TOKEN is set
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', '0'))
+
+# Sessions older than this are moved to compressed files by retention.py
+app.config['SESSION_RETENTION_DAYS'] = int(os.environ.get('SESSION_RETENTION_DAYS', '365'))
+app.config['SESSION_ARCHIVE_DIR'] = os.environ.get('SESSION_ARCHIVE_DIR', 'archive')
+
+# Warm start: compile templates (cached as bytecode on disk) and load the tree
+# from a snapshot file while the worker boots; see startup.py
+app.config['WARM_START'] = os.environ.get('WARM_START', '').lower() in ('1', 'true', 'yes')
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR', '.cache/templates')
+app.config['TREE_SNAPSHOT_PATH'] = os.environ.get('TREE_SNAPSHOT_PATH', '.cache/tree.json')
+app.config['COLD_START_BUDGET_MS'] = float(os.environ.get('COLD_START_BUDGET_MS', '0'))
+
 db.init_app(app)
+tree_cache.init_app(app)
+telemetry.init_app(app)
+metrics.init_app(app)
+# Only check the session when there is a cookie, so anonymous responses don't vary on it
+metrics.show_timing_to(lambda: bool(request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+                                    and session.get('admin_logged_in')))
+metrics.add_value('troubleshooting_telemetry_events_written_total', 'Telemetry events written',
+                  lambda: telemetry.written, kind='counter')
+metrics.add_value('troubleshooting_telemetry_events_dropped_total', 'Telemetry events dropped',
+                  lambda: telemetry.dropped, kind='counter')
+metrics.add_value('troubleshooting_tree_version', 'Decision tree version served',
+                  lambda: tree_cache.get().version)
+assets.init_app(app)
+startup.init_app(app)
+for phase in startup.phases:
+    metrics.add_value(f'troubleshooting_startup_{phase}_seconds', f'Warm start time spent on {phase}',
+                      lambda phase=phase: startup.phases[phase])
+metrics.add_value('troubleshooting_startup_deferred_templates', 'Templates left to compile on first use',
+                  lambda: startup.deferred_templates)
+app.register_blueprint(api)
+
+# Optional in-process sweeper; otherwise run `python sweeper.py` from cron
+if app.config['ABANDONED_SWEEP_INTERVAL_SECONDS'] > 0:
+    sweeper.start_background_sweeper(
+        app,
+        app.config['ABANDONED_SWEEP_INTERVAL_SECONDS'],
+        app.config['ABANDONED_AFTER_MINUTES']
+    )
 
 # Admin credentials from environment variables
 ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD')
 
+def record_answer(question, answer):
+    """Append an answered question to the session history, returning the new step and its position"""
+    step = {
+        'question': question.text,
+        'answer': answer.text,
+        'answer_id': answer.id
+    }
+    if app.config['COMPACT_SESSION_HISTORY']:
+        path = session.get('path', [])
+        path.append(answer.id)
+        session['path'] = path
+    else:
+        path = session.get('history', [])
+        path.append(step)
+        session['history'] = path
+    return step, len(path) - 1
+
+def session_history():
+    """Question/answer pairs answered so far in this session"""
+    if app.config['COMPACT_SESSION_HISTORY']:
+        return tree_cache.get().history_for(session.get('path', []))
+    return session.get('history', [])
+
 @app.route('/')
 def index():
     """Landing page"""
@@ -29,22 +147,28 @@ def index():
 def start():
     """Start a new troubleshooting session"""
     session.clear()
-    session['history'] = []
-    session['current_question'] = 'start'
+    if app.config['COMPACT_SESSION_HISTORY']:
+        session['path'] = []
+    else:
+        session['history'] = []
+    # Search results jump straight to the question they matched
+    jump_to = request.args.get('at')
+    if not (jump_to and jump_to != 'start' and tree_cache.get().get_question(jump_to)):
+        jump_to = None
+    session['current_question'] = jump_to or 'start'
     
     # Create new session tracking
     session_id = str(uuid.uuid4())
     session['tracking_id'] = session_id
     
-    # Create database record
-    new_session = TroubleshootingSession(
+    # Queue the database record
+    telemetry.session_started(
         session_id=session_id,
         started_at=datetime.utcnow(),
         ip_address=request.remote_addr,
-        user_agent=request.headers.get('User-Agent', '')[:500]
+        user_agent=request.headers.get('User-Agent', '')[:500],
+        entry_question=jump_to
     )
-    db.session.add(new_session)
-    db.session.commit()
     
     return redirect(url_for('question'))
 
@@ -60,26 +184,32 @@ def question():
         if not answer_id or not current_q_id:
             return redirect(url_for('start'))
         
-        # Get answer from database
-        answer = Answer.query.get(answer_id)
-        if not answer:
+        # Get answer from the compiled tree
+        tree = tree_cache.get()
+        answer = tree.get_answer(answer_id)
+        current_question = tree.get_question(current_q_id)
+        if not answer or not current_question:
             return redirect(url_for('start'))
         
-        # Save to history
-        history = session.get('history', [])
-        current_question = Question.query.filter_by(question_id=current_q_id).first()
-        history.append({
-            'question': current_question.text,
-            'answer': answer.text
-        })
-        session['history'] = history
+        # Save to history; steps already recorded are keyed by position, so only the new one is sent
+        step, position = record_answer(current_question, answer)
+        if session.get('tracking_id') and answer.next_question_id:
+            telemetry.session_progress(session['tracking_id'], [step], first_position=position)
         
         # Check if this answer leads to next question or conclusion
         if answer.next_question_id:
             session['current_question'] = answer.next_question_id
             return redirect(url_for('question'))
-        elif answer.conclusion:
-            return redirect(url_for('conclusion', conclusion=answer.conclusion))
+        elif answer.conclusion_id:
+            # Recorded here so the conclusion page itself has no side effects and can be cached
+            if session.get('tracking_id'):
+                telemetry.session_completed(
+                    session_id=session['tracking_id'],
+                    completed_at=datetime.utcnow(),
+                    path=session_history(),
+                    conclusion_id=answer.conclusion_id
+                )
+            return redirect(url_for('conclusion', conclusion_id=answer.conclusion_id))
         else:
             # No next question and no conclusion - error state
             flash('Configuration error: answer has no next step')
@@ -90,52 +220,107 @@ def question():
     if not current_q_id:
         return redirect(url_for('start'))
     
-    # Get question from database
-    current_question = Question.query.filter_by(question_id=current_q_id).first()
+    # Get question from the compiled tree
+    current_question = tree_cache.get().get_question(current_q_id)
     if not current_question:
         flash(f'Question "{current_q_id}" not found in database')
         return redirect(url_for('start'))
     
-    # Get answers for this question
-    answers = Answer.query.filter_by(question_id=current_question.id).order_by(Answer.order).all()
+    # Answers are already in display order
+    answers = current_question.answers
     
-    history = session.get('history', [])
+    history = session_history()
     
     return render_template('question.html', 
                          question=current_question,
                          answers=answers,
                          history=history)
 
+@app.route('/search')
+def search_page():
+    """Find a question by words in it, its answers or their conclusions"""
+    query = request.args.get('q', '').strip()
+    hits = search.search(tree_cache.get(), query) if query else []
+    return render_template('search.html', query=query, hits=hits, admin=False)
+
 @app.route('/conclusion')
-def conclusion():
-    """Display the final conclusion"""
-    conclusion_text = request.args.get('conclusion')
-    
-    if not conclusion_text:
+def legacy_conclusion():
+    """Old ?conclusion=<text> links, redirected to the conclusion's own URL"""
+    conclusion_id = tree_cache.get().conclusion_ids.get(request.args.get('conclusion'))
+    if conclusion_id is None:
         return redirect(url_for('start'))
-    
-    history = session.get('history', [])
-    
-    # Update session tracking
-    tracking_id = session.get('tracking_id')
-    if tracking_id:
-        tracking_session = TroubleshootingSession.query.filter_by(session_id=tracking_id).first()
-        if tracking_session:
-            tracking_session.completed_at = datetime.utcnow()
-            tracking_session.path_taken = history
-            tracking_session.conclusion_reached = conclusion_text
-            tracking_session.abandoned = False
-            db.session.commit()
-    
-    return render_template('conclusion.html', 
-                         conclusion=conclusion_text,
-                         history=history)
+    return redirect(url_for('conclusion', conclusion_id=conclusion_id), 301)
+
+@app.route('/conclusion/<int:conclusion_id>')
+def conclusion(conclusion_id):
+    """Display the final conclusion"""
+    conclusion_text = tree_cache.get().conclusions.get(conclusion_id)
+    if conclusion_text is None:
+        # Bookmarked conclusions that answers no longer lead to, while a recorded session still does
+        conclusion_text = db.session.query(Conclusion.text).filter(
+            Conclusion.id == conclusion_id,
+            db.session.query(TroubleshootingSession.id).filter_by(conclusion_id=conclusion_id).exists()
+        ).scalar()
+        if conclusion_text is None:
+            abort(404)
+    
+    history = session_history()
+    
+    # The page shows this visitor's path, so it is only cached by their own browser
+    etag = content_hash(dumps([conclusion_text, history]))
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(render_template('conclusion.html',
+                                                      conclusion=conclusion_text,
+                                                      history=history))
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/restart')
 def restart():
     """Restart the troubleshooting process"""
     return redirect(url_for('start'))
 
+# Offline client: walks the tree bundle in the browser and syncs sessions later
+@app.route('/offline/')
+def offline():
+    """Offline-capable troubleshooting page"""
+    return render_template('offline.html')
+
+@app.route('/offline/sw.js')
+def offline_service_worker():
+    """Service worker, served from /offline/ so its scope covers the offline page"""
+    response = send_from_directory(os.path.join(app.static_folder, 'offline'), 'sw.js', max_age=0)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/offline/manifest.json')
+def offline_manifest():
+    """Name of the current tree bundle"""
+    response = jsonify(bundle.manifest(tree_cache.get().offline_bundle))
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/offline/<filename>')
+def offline_tree(filename):
+    """Current tree bundle, precompressed once per tree version"""
+    current = tree_cache.get().offline_bundle
+    if filename != current.filename:
+        # Superseded by an edit; the client picks up the new name from the manifest
+        abort(404)
+    encoding = bundle.choose_encoding(current, request.accept_encodings)
+    response = app.response_class(current.encodings[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 # Admin routes
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
@@ -171,16 +356,74 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def commit_tree_change(notify=True):
+    """Commit an admin edit and swap in the rebuilt decision tree"""
+    # Bumping in the same transaction tells the other workers to reload
+    bump_version()
+    db.session.commit()
+    tree = tree_cache.refresh()
+    search.refresh(tree)
+    report = tree_validator.check(tree)
+    if notify and report.errors:
+        flash(f'The decision tree now has {report.errors} problem(s) - see Tree Health on the dashboard', 'error')
+
+def unknown_next_question(next_question_id):
+    """True if an answer form names a next question that doesn't exist"""
+    return bool(next_question_id) and not db.session.query(Question.id).filter_by(
+        question_id=next_question_id
+    ).first()
+
+def like_pattern(term):
+    """Escape LIKE wildcards in user input and wrap it for a substring match"""
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
     """Admin dashboard"""
+    search = request.args.get('q', '').strip()
+    query = Question.query
+    if search:
+        pattern = like_pattern(search)
+        query = query.filter(db.or_(
+            Question.question_id.ilike(pattern, escape='\\'),
+            Question.text.ilike(pattern, escape='\\'),
+            Question.category.ilike(pattern, escape='\\')
+        ))
+    
     # Sort by category first, then by question_id alphabetically
-    questions = Question.query.order_by(
+    pagination = query.order_by(
         Question.category.asc().nullsfirst(),
         Question.question_id.asc()
-    ).all()
-    return render_template('admin_dashboard.html', questions=questions)
+    ).paginate(
+        page=request.args.get('page', 1, type=int),
+        per_page=app.config['ADMIN_QUESTIONS_PER_PAGE'],
+        error_out=False
+    )
+    
+    # One grouped query for the page instead of loading each question's answers
+    answer_counts = dict(db.session.query(
+        Answer.question_id,
+        db.func.count(Answer.id)
+    ).filter(
+        Answer.question_id.in_([q.id for q in pagination.items])
+    ).group_by(Answer.question_id).all())
+    
+    tree_report = tree_validator.check(tree_cache.get())
+    return render_template('admin_dashboard.html',
+                         questions=pagination.items,
+                         pagination=pagination,
+                         answer_counts=answer_counts,
+                         search=search,
+                         tree_report=tree_report)
+
+@app.route('/admin/search')
+@admin_required
+def admin_search():
+    """Search question, answer and conclusion text with links to the editor"""
+    query = request.args.get('q', '').strip()
+    hits = search.search(tree_cache.get(), query) if query else []
+    return render_template('search.html', query=query, hits=hits, admin=True)
 
 @app.route('/admin/question/add', methods=['GET', 'POST'])
 @admin_required
@@ -203,7 +446,7 @@ def admin_add_question():
             category=category
         )
         db.session.add(question)
-        db.session.commit()
+        commit_tree_change()
         
         flash(f'Question "{question_id}" added successfully', 'success')
         return redirect(url_for('admin_edit_question', id=question.id))
@@ -220,13 +463,15 @@ def admin_edit_question(id):
         question.question_id = request.form.get('question_id')
         question.text = request.form.get('text')
         question.category = request.form.get('category', '')
-        db.session.commit()
+        answer_edits.claim(id)
+        commit_tree_change()
         flash('Question updated successfully', 'success')
         return redirect(url_for('admin_edit_question', id=id))
     
     # Sort answers by order
     answers = Answer.query.filter_by(question_id=id).order_by(Answer.order.asc()).all()
-    all_questions = Question.query.order_by(Question.question_id.asc()).all()
+    # The next-question picker comes from the in-memory tree, not another query
+    all_questions = tree_cache.get().ordered_questions
     
     return render_template('admin_question_form.html', 
                          question=question, 
@@ -239,12 +484,15 @@ def admin_delete_question(id):
     """Delete question"""
     question = Question.query.get_or_404(id)
     
-    # Delete all answers for this question
+    # Delete all answers for this question, keeping their text on recorded sessions.
+    # Only ids are read, so the cascade below doesn't delete the already deleted answers again
+    answer_ids = [answer_id for (answer_id,) in db.session.query(Answer.id).filter_by(question_id=id)]
+    session_steps.preserve_answer_text(answer_ids)
     Answer.query.filter_by(question_id=id).delete()
     
     # Delete the question
     db.session.delete(question)
-    db.session.commit()
+    commit_tree_change()
     
     flash(f'Question "{question.question_id}" deleted successfully', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -256,21 +504,24 @@ def admin_add_answer(question_id):
     question = Question.query.get_or_404(question_id)
     
     text = request.form.get('text')
-    next_question_id = request.form.get('next_question_id') or None
+    next_question_id = request.form.get('next_question_id', '').strip() or None
     conclusion = request.form.get('conclusion') or None
     
-    # Get the highest order number for this question
-    max_order = db.session.query(db.func.max(Answer.order)).filter_by(question_id=question_id).scalar() or 0
+    if unknown_next_question(next_question_id):
+        flash(f'Question "{next_question_id}" does not exist', 'error')
+        return redirect(url_for('admin_edit_question', id=question_id))
     
+    # Claiming the question first queues concurrent adds, so each gets its own position
+    answer_edits.claim(question_id)
     answer = Answer(
         question_id=question_id,
         text=text,
         next_question_id=next_question_id,
-        conclusion=conclusion,
-        order=max_order + 1
+        conclusion_id=conclusions.id_for(conclusion),
+        order=answer_edits.next_order(question_id)
     )
     db.session.add(answer)
-    db.session.commit()
+    commit_tree_change()
     
     flash('Answer added successfully', 'success')
     return redirect(url_for('admin_edit_question', id=question_id))
@@ -281,11 +532,17 @@ def admin_edit_answer(id):
     """Edit answer"""
     answer = Answer.query.get_or_404(id)
     
+    next_question_id = request.form.get('next_question_id', '').strip() or None
+    if unknown_next_question(next_question_id):
+        flash(f'Question "{next_question_id}" does not exist', 'error')
+        return redirect(url_for('admin_edit_question', id=answer.question_id))
+    
     answer.text = request.form.get('text')
-    answer.next_question_id = request.form.get('next_question_id') or None
-    answer.conclusion = request.form.get('conclusion') or None
+    answer.next_question_id = next_question_id
+    answer.conclusion_id = conclusions.id_for(request.form.get('conclusion') or None)
     
-    db.session.commit()
+    answer_edits.claim(answer.question_id)
+    commit_tree_change()
     
     flash('Answer updated successfully', 'success')
     return redirect(url_for('admin_edit_question', id=answer.question_id))
@@ -297,8 +554,10 @@ def admin_delete_answer(id):
     answer = Answer.query.get_or_404(id)
     question_id = answer.question_id
     
+    session_steps.preserve_answer_text([answer.id])
     db.session.delete(answer)
-    db.session.commit()
+    answer_edits.claim(question_id)
+    commit_tree_change()
     
     flash('Answer deleted successfully', 'success')
     return redirect(url_for('admin_edit_question', id=question_id))
@@ -318,7 +577,8 @@ def admin_move_answer_up(id):
     if answer_above:
         # Swap orders
         answer.order, answer_above.order = answer_above.order, answer.order
-        db.session.commit()
+        answer_edits.claim(answer.question_id)
+        commit_tree_change()
         flash('Answer moved up', 'success')
     else:
         flash('Answer is already at the top', 'error')
@@ -340,66 +600,114 @@ def admin_move_answer_down(id):
     if answer_below:
         # Swap orders
         answer.order, answer_below.order = answer_below.order, answer.order
-        db.session.commit()
+        answer_edits.claim(answer.question_id)
+        commit_tree_change()
         flash('Answer moved down', 'success')
     else:
         flash('Answer is already at the bottom', 'error')
     
     return redirect(url_for('admin_edit_question', id=answer.question_id))
 
+@app.route('/admin/question/<int:id>/answers', methods=['GET', 'POST'])
+@admin_required
+def admin_answers_batch(id):
+    """A question's answers as JSON; POST reorders and edits them in one transaction
+
+    The body is {"version": n, "order": [answer ids], "answers": [{"id": ...,
+    "text": ..., "next_question_id": ..., "conclusion": ...}]}, where version
+    is the one this editor last saw. If someone has saved the question since,
+    nothing is applied and the current state comes back with a 409.
+    """
+    if request.method == 'POST':
+        try:
+            batch = answer_edits.parse_batch(request.get_json(silent=True))
+            changed = answer_edits.apply_batch(id, *batch)
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        if changed is None:
+            db.session.rollback()
+            state = answer_edits.question_state(id)
+            if state is None:
+                abort(404)
+            return jsonify(dict(state, error='This question was changed by someone else')), 409
+        if changed:
+            commit_tree_change(notify=False)
+        else:
+            # Nothing to save; leave the version alone so other editors aren't refused
+            db.session.rollback()
+    
+    state = answer_edits.question_state(id)
+    if state is None:
+        abort(404)
+    # Cached per tree, so this is free unless the tree just changed
+    return jsonify(dict(state, tree_problems=tree_validator.check(tree_cache.get()).errors))
+
 @app.route('/admin/analytics')
 @admin_required
 def admin_analytics():
     """Analytics dashboard"""
-    from sqlalchemy import func
-    
-    # Total sessions
-    total_sessions = TroubleshootingSession.query.count()
-    completed_sessions = TroubleshootingSession.query.filter_by(abandoned=False).count()
-    abandoned_sessions = TroubleshootingSession.query.filter_by(abandoned=True).count()
-    
-    # Most common conclusions
-    conclusion_stats = db.session.query(
-        TroubleshootingSession.conclusion_reached,
-        func.count(TroubleshootingSession.id).label('count')
-    ).filter(
-        TroubleshootingSession.conclusion_reached.isnot(None)
-    ).group_by(
-        TroubleshootingSession.conclusion_reached
-    ).order_by(
-        func.count(TroubleshootingSession.id).desc()
-    ).limit(10).all()
-    
-    # Recent sessions
-    recent_sessions = TroubleshootingSession.query.order_by(
-        TroubleshootingSession.started_at.desc()
-    ).limit(20).all()
-    
-    # Average questions per session - calculated in Python
-    all_sessions = TroubleshootingSession.query.filter(
-        TroubleshootingSession.path_taken.isnot(None)
-    ).all()
-
-    if all_sessions:
-        total_questions = sum(len(s.path_taken) for s in all_sessions if s.path_taken)
-        avg_questions = round(total_questions / len(all_sessions), 1) if all_sessions else 0
-    else:
-        avg_questions = 0
+    # Date range filter (inclusive dates), defaulting to the last 30 days
+    today = datetime.utcnow().date()
+    try:
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else today - timedelta(days=29)
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else today
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'error')
+        return redirect(url_for('admin_analytics'))
+    
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
     
     return render_template('admin_analytics.html',
-                         total_sessions=total_sessions,
-                         completed_sessions=completed_sessions,
-                         abandoned_sessions=abandoned_sessions,
-                         conclusion_stats=conclusion_stats,
-                         recent_sessions=recent_sessions,
-                         avg_questions=round(avg_questions, 1))
+                         start_date=start_date,
+                         end_date=end_date,
+                         **analytics.dashboard_metrics(start, end))
+
+@app.route('/admin/funnel')
+@admin_required
+def admin_funnel():
+    """Edge traffic and drop-off overlaid on the decision tree"""
+    edges = FunnelEdge.query.all()
+    nodes = {node.question_id: node for node in FunnelNode.query.all()}
+    traversals = {edge.answer_id: edge.traversals for edge in edges if edge.answer_id is not None}
+    unmatched = sorted((edge for edge in edges if edge.answer_id is None), key=lambda edge: -edge.traversals)
+    computed_at = max((row.computed_at for row in edges + list(nodes.values())), default=None)
+    
+    return render_template('admin_funnel.html',
+                         questions=funnel.tree_order(tree_cache.get()),
+                         nodes=nodes,
+                         traversals=traversals,
+                         unmatched=unmatched,
+                         computed_at=computed_at)
+
+@app.route('/admin/funnel/refresh', methods=['POST'])
+@admin_required
+def admin_refresh_funnel():
+    """Recompute the funnel tables from recorded session paths"""
+    sessions = funnel.refresh_funnel(tree_cache.get())
+    flash(f'Funnel recomputed from {sessions} sessions', 'success')
+    return redirect(url_for('admin_funnel'))
 
 @app.route('/admin/session/<session_id>')
 @admin_required
 def admin_view_session(session_id):
     """View detailed session information"""
-    session_record = TroubleshootingSession.query.filter_by(session_id=session_id).first_or_404()
-    return render_template('admin_session_detail.html', session=session_record)
+    session_record = TroubleshootingSession.query.filter_by(session_id=session_id).first()
+    archived = session_record is None
+    if archived:
+        # Older sessions may have been moved out of the database by retention.py
+        session_record = retention.find_archived_session(app.config['SESSION_ARCHIVE_DIR'], session_id)
+        if session_record is None:
+            abort(404)
+    return render_template('admin_session_detail.html',
+                         session=session_record,
+                         path=session_steps.session_path(session_record, tree_cache.get()),
+                         archived=archived)
+
+# Last, so every route and template global the warm-up touches is registered
+if app.config['WARM_START']:
+    startup.warm(app)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,84 @@
+"""
+Fingerprinted stylesheets
+Page styles live in static/css and are linked with asset_url('question.css'),
+which points at /assets/question.<hash>.css. The name changes whenever the file
+does, so browsers and proxies cache each version forever and a deploy never
+serves a page with an old stylesheet. Each file is read, hashed and
+precompressed once per worker.
+"""
+
+import os
+import threading
+from collections import namedtuple
+from flask import abort, request, url_for
+from api import IMMUTABLE_MAX_AGE, content_hash
+import bundle
+
+# Fingerprinted stylesheet, with encodings shaped like a bundle for choose_encoding()
+Asset = namedtuple('Asset', ['name', 'filename', 'encodings'])
+
+class Assets:
+    """Serves static/css under content-hashed names with far-future caching"""
+
+    def __init__(self):
+        self.directory = None
+        self.response_class = None
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Register the /assets route and the asset_url() template global"""
+        self.directory = os.path.join(app.static_folder, 'css')
+        self.response_class = app.response_class
+        app.add_url_rule('/assets/<filename>', 'asset', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    def get(self, name):
+        """Asset for a stylesheet name such as 'question.css', loaded on first use"""
+        asset = self._assets.get(name)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.get(name) or self._load(name)
+        return asset
+
+    def _load(self, name):
+        path = os.path.join(self.directory, os.path.basename(name))
+        with open(path, 'rb') as f:
+            body = f.read()
+        stem, ext = os.path.splitext(name)
+        asset = Asset(name, f'{stem}.{content_hash(body)[:12]}{ext}', bundle.compress(body))
+        self._assets[name] = asset
+        return asset
+
+    def load_all(self):
+        """Fingerprint every stylesheet now rather than on the first page that links it"""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith('.css'))
+        for name in names:
+            self.get(name)
+        return len(names)
+
+    def url(self, name):
+        """URL of the current version of a stylesheet"""
+        return url_for('asset', filename=self.get(name).filename)
+
+    def serve(self, filename):
+        """Stylesheet by fingerprinted name; superseded versions are gone"""
+        stem, _, rest = filename.partition('.')
+        name = f'{stem}.{rest.rpartition(".")[2]}'
+        try:
+            asset = self.get(name)
+        except OSError:
+            abort(404)
+        if filename != asset.filename:
+            abort(404)
+        encoding = bundle.choose_encoding(asset, request.accept_encodings)
+        response = self.response_class(asset.encodings[encoding], mimetype='text/css')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        return response
+
+assets = Assets()
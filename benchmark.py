@@ -0,0 +1,505 @@
+"""
+End-to-end benchmark
+Builds a synthetic decision tree, has N concurrent technicians walk random
+start -> conclusion paths, and reports latency percentiles, queries per request
+and session cookie size per step. It then seeds the sessions table and times
+the admin analytics page. Results are written as JSON so runs can be compared.
+
+The database is replaced wholesale (tree and sessions), so point it at a
+throwaway SQLite file or a local Postgres, never at production. DATABASE_URL is
+ignored on purpose.
+
+With --gevent-isolation it instead checks the gevent serving profile
+(gunicorn.conf.py): concurrent greenlets, each in its own request context,
+hold a database connection across a slow query, and the check fails if any
+two of them share a session or connection, or if they ran one after another.
+
+Usage:
+    python benchmark.py [--database-url URL] [--depth 5] [--fanout 3]
+                        [--technicians 20] [--walks 10] [--sessions 1000000]
+                        [--url http://localhost:8000] [--compare old.json]
+    python benchmark.py --gevent-isolation [--database-url URL] [--greenlets 10]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+from http.cookiejar import CookieJar
+
+ANSWER_INPUT = re.compile(r'name="answer_id"\s+value="(\d+)"')
+
+def percentile(values, p):
+    """Linearly interpolated percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = p * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values, digits=2):
+    """Count, mean and p50/p95/p99 of a list of numbers"""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values), digits),
+        'p50': round(percentile(values, 0.50), digits),
+        'p95': round(percentile(values, 0.95), digits),
+        'p99': round(percentile(values, 0.99), digits),
+        'max': round(max(values), digits)
+    }
+
+def synthetic_tree(depth, fanout):
+    """decision_tree.yaml-shaped questions: a full tree with conclusions at the leaves"""
+    questions = {}
+    level = ['start']
+    for d in range(depth):
+        next_level = []
+        for q_id in level:
+            answers = []
+            for i in range(fanout):
+                answer = {'text': f'Option {i + 1} for {q_id}'}
+                if d == depth - 1:
+                    answer['conclusion'] = f'Fix {i + 1} for {q_id}: replace the part and re-test.'
+                else:
+                    child = f'{q_id}_{i + 1}' if q_id != 'start' else f'q{i + 1}'
+                    answer['next'] = child
+                    next_level.append(child)
+                answers.append(answer)
+            questions[q_id] = {
+                'text': f'Synthetic question {q_id} at depth {d + 1}?',
+                'category': f'Category {q_id.split("_")[0]}',
+                'answers': answers
+            }
+        level = next_level
+    return questions
+
+class QueryCounter:
+    """Counts SQL statements per thread, so each simulated technician sees its own"""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+class TestClientDriver:
+    """Walks the flow in-process through the Flask test client"""
+
+    def __init__(self, app, counter):
+        self.client = app.test_client()
+        self.counter = counter
+
+    def request(self, method, path, data=None):
+        self.counter.take()
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, data=data)
+        elapsed = (time.perf_counter() - started) * 1000
+        cookie = self.client.get_cookie('session')
+        return {
+            'status': response.status_code,
+            'location': response.headers.get('Location', ''),
+            'body': response.get_data(as_text=True),
+            'ms': elapsed,
+            'queries': self.counter.take(),
+            'cookie_bytes': len(cookie.value) if cookie else 0
+        }
+
+class HttpDriver:
+    """Walks the flow against a running server (queries can't be counted)"""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), self._NoRedirect
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        started = time.perf_counter()
+        try:
+            response = self.opener.open(req, timeout=30)
+        except urllib.error.HTTPError as e:
+            # Redirects arrive here because the handler refuses to follow them
+            response = e
+        text = response.read().decode('utf-8', 'replace')
+        elapsed = (time.perf_counter() - started) * 1000
+        cookie = next((c for c in self.cookies if c.name == 'session'), None)
+        return {
+            'status': response.status,
+            'location': response.headers.get('Location', ''),
+            'body': text,
+            'ms': elapsed,
+            'queries': None,
+            'cookie_bytes': len(cookie.value) if cookie else 0
+        }
+
+def walk(driver, rng, record):
+    """One technician session from /start to a conclusion; returns the step count"""
+    step = driver.request('GET', '/start')
+    record('start', step)
+    steps = 0
+    while True:
+        page = driver.request('GET', '/question')
+        record('question', page)
+        answer_ids = ANSWER_INPUT.findall(page['body'])
+        if page['status'] != 200 or not answer_ids:
+            raise RuntimeError(f"question page returned {page['status']} with no answers")
+        post = driver.request('POST', '/question', {'answer_id': rng.choice(answer_ids)})
+        record('answer', post)
+        steps += 1
+        location = urllib.parse.urlparse(post['location'])
+        if location.path.startswith('/conclusion/'):
+            record('conclusion', driver.request('GET', location.path))
+            return steps
+
+def run_flow(make_driver, technicians, walks, seed):
+    """Run walks sessions on each of technicians threads and collect per-request samples"""
+    samples = {}
+    lock = threading.Lock()
+    errors = []
+    steps = []
+
+    def technician(index):
+        rng = random.Random(seed + index)
+        driver = make_driver()
+        local = {}
+
+        def record(kind, result):
+            local.setdefault(kind, []).append(result)
+
+        try:
+            for _ in range(walks):
+                steps.append(walk(driver, rng, record))
+        except Exception as e:  # report, don't hang the other threads
+            errors.append(repr(e))
+        with lock:
+            for kind, results in local.items():
+                samples.setdefault(kind, []).extend(results)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=technician, args=(i,)) for i in range(technicians)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    every = [r for results in samples.values() for r in results]
+    report = {
+        'technicians': technicians,
+        'sessions': len(steps),
+        'requests': len(every),
+        'seconds': round(elapsed, 2),
+        'requests_per_second': round(len(every) / elapsed, 1) if elapsed else None,
+        'answers_per_session': summarize(steps),
+        'latency_ms': summarize([r['ms'] for r in every]),
+        'errors': errors[:10]
+    }
+    for kind, results in samples.items():
+        queries = [r['queries'] for r in results if r['queries'] is not None]
+        report[kind] = {
+            'latency_ms': summarize([r['ms'] for r in results]),
+            'queries_per_request': summarize(queries) if queries else None,
+            'cookie_bytes': summarize([r['cookie_bytes'] for r in results], digits=0)
+        }
+    return report
+
+def seed_sessions(app, tree, total, chunk_size=20000, seed=1):
+    """Fill troubleshooting_sessions and session_steps with total synthetic sessions spread over 90 days"""
+    from sqlalchemy import insert
+    from models import db, TroubleshootingSession, SessionStep
+    import rollups
+
+    with app.app_context():
+        existing = db.session.query(db.func.count(TroubleshootingSession.id)).scalar()
+        if existing >= total:
+            print(f"✓ Reusing {existing} seeded sessions")
+            return existing
+        rng = random.Random(seed)
+        now = datetime.utcnow()
+        # A pool of real paths through the synthetic tree, reused across rows
+        paths = []
+        for _ in range(500):
+            question = tree.get_question('start')
+            path = []
+            while question:
+                answer = rng.choice(question.answers)
+                path.append({'answer_id': answer.id})
+                if answer.conclusion_id:
+                    paths.append((path, answer.conclusion_id))
+                    break
+                question = tree.get_question(answer.next_question_id)
+
+        made = existing
+        while made < total:
+            rows = []
+            steps = []
+            for i in range(made, min(made + chunk_size, total)):
+                started_at = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+                path, conclusion_id = rng.choice(paths)
+                row = {
+                    'session_id': f'bench-{i}',
+                    'started_at': started_at,
+                    'ip_address': '127.0.0.1',
+                    'user_agent': 'benchmark',
+                    'abandoned': False
+                }
+                roll = rng.random()
+                if roll < 0.8:
+                    row.update(completed_at=started_at + timedelta(seconds=rng.randint(20, 900)),
+                               conclusion_id=conclusion_id)
+                elif roll < 0.9:
+                    path = path[:1]
+                    row.update(abandoned=True)
+                else:
+                    path = []
+                answered_at = started_at
+                for position, step in enumerate(path):
+                    answered_at += timedelta(seconds=rng.randint(5, 120))
+                    steps.append({'session_id': row['session_id'], 'position': position,
+                                  'answer_id': step['answer_id'], 'answered_at': answered_at})
+                rows.append(row)
+            db.session.execute(insert(TroubleshootingSession), rows)
+            db.session.execute(insert(SessionStep), steps)
+            db.session.commit()
+            made += len(rows)
+            print(f"✓ Seeded {made} sessions")
+        rollups.rebuild_rollups(chunk_size=50000)
+        return made
+
+def run_analytics(app, counter, repeats):
+    """Time the admin analytics page for a 30-day and a 2-day range"""
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['admin_logged_in'] = True
+    today = datetime.utcnow().date()
+    ranges = {
+        'last_30_days': '/admin/analytics',
+        'last_2_days': f'/admin/analytics?start={today - timedelta(days=1)}&end={today}'
+    }
+    report = {}
+    for name, path in ranges.items():
+        client.get(path)  # warm the tree cache and connection
+        times = []
+        queries = []
+        for _ in range(repeats):
+            counter.take()
+            started = time.perf_counter()
+            response = client.get(path)
+            times.append((time.perf_counter() - started) * 1000)
+            queries.append(counter.take())
+            if response.status_code != 200:
+                raise RuntimeError(f'{path} returned {response.status_code}')
+        report[name] = {'latency_ms': summarize(times), 'queries_per_request': summarize(queries)}
+    return report
+
+def check_gevent_isolation(app, greenlets, hold_seconds=0.2):
+    """Run greenlets concurrent request contexts that each hold a connection; returns problems found"""
+    import gevent
+    from sqlalchemy import text
+    from models import db
+
+    with app.app_context():
+        postgres = db.engine.dialect.name == 'postgresql'
+    # pg_sleep only lets other greenlets run if psycogreen made psycopg2 cooperative
+    slow_query = text('SELECT pg_sleep(:s)') if postgres else None
+    seen = []
+
+    def request(index):
+        with app.test_request_context(f'/isolation/{index}'):
+            first = db.session.connection().connection.dbapi_connection
+            if postgres:
+                db.session.execute(slow_query, {'s': hold_seconds})
+            else:
+                db.session.execute(text('SELECT 1'))
+                gevent.sleep(hold_seconds)
+            last = db.session.connection().connection.dbapi_connection
+            seen.append((index, id(db.session()), id(first), first is last))
+            db.session.remove()
+
+    started = time.perf_counter()
+    gevent.joinall([gevent.spawn(request, i) for i in range(greenlets)], raise_error=True)
+    elapsed = time.perf_counter() - started
+
+    problems = []
+    if len({session for _, session, _, _ in seen}) != greenlets:
+        problems.append('greenlets shared a database session')
+    if len({connection for _, _, connection, _ in seen}) != greenlets:
+        problems.append('greenlets shared a database connection')
+    if not all(kept for _, _, _, kept in seen):
+        problems.append('a request switched connections mid-transaction')
+    if elapsed > hold_seconds * greenlets / 2:
+        problems.append(f'requests ran one after another ({elapsed:.2f} s for {greenlets} x {hold_seconds} s)')
+    print(f"✓ {greenlets} concurrent greenlets finished in {elapsed:.2f} s "
+          f"({len({c for _, _, c, _ in seen})} distinct connections)")
+    return problems
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new):
+    """Print the headline numbers of two result files side by side"""
+    def dig(result, *keys):
+        for key in keys:
+            if not isinstance(result, dict):
+                return None
+            result = result.get(key)
+        return result
+
+    rows = [
+        ('flow p50 ms', ('flow', 'latency_ms', 'p50')),
+        ('flow p95 ms', ('flow', 'latency_ms', 'p95')),
+        ('flow p99 ms', ('flow', 'latency_ms', 'p99')),
+        ('flow requests/s', ('flow', 'requests_per_second')),
+        ('question queries', ('flow', 'question', 'queries_per_request', 'mean')),
+        ('answer queries', ('flow', 'answer', 'queries_per_request', 'mean')),
+        ('cookie bytes p99', ('flow', 'answer', 'cookie_bytes', 'p99')),
+        ('analytics 30d p50 ms', ('analytics', 'last_30_days', 'latency_ms', 'p50')),
+        ('analytics 2d p50 ms', ('analytics', 'last_2_days', 'latency_ms', 'p50')),
+    ]
+    print(f"{'':24}{'before':>12}{'after':>12}{'change':>10}")
+    for label, keys in rows:
+        before = dig(old, *keys)
+        after = dig(new, *keys)
+        change = f'{(after - before) / before * 100:+.0f}%' if before and after is not None else ''
+        print(f"{label:24}{before if before is not None else '-':>12}{after if after is not None else '-':>12}{change:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the troubleshooting flow and analytics page')
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.abspath('benchmark.db'),
+                        help='throwaway database to (re)build (default: ./benchmark.db)')
+    parser.add_argument('--depth', type=int, default=5, help='questions from start to a conclusion')
+    parser.add_argument('--fanout', type=int, default=3, help='answers per question')
+    parser.add_argument('--technicians', type=int, default=20, help='concurrent simulated technicians')
+    parser.add_argument('--walks', type=int, default=10, help='sessions walked by each technician')
+    parser.add_argument('--sessions', type=int, default=1000000, help='sessions to seed for analytics (0 to skip)')
+    parser.add_argument('--analytics-repeats', type=int, default=20)
+    parser.add_argument('--url', help='walk a running server instead of the in-process test client')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='result file (default: benchmark-results/<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--gevent-isolation', action='store_true',
+                        help='only check that concurrent gevent requests never share a DB session or connection')
+    parser.add_argument('--greenlets', type=int, default=10,
+                        help='concurrent requests for --gevent-isolation (keep within DB_POOL_SIZE + DB_MAX_OVERFLOW)')
+    args = parser.parse_args()
+
+    if args.gevent_isolation:
+        # Patched before the app (and its engine) is imported, as a gevent worker would be
+        from gevent import monkey
+        monkey.patch_all()
+        if args.database_url.startswith('postgres'):
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+
+    # app.py reads its configuration at import time
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    from app import app
+    from models import db
+    from init_db import init_db
+    from tree_cache import tree_cache
+    from telemetry import telemetry
+    import tree_sync
+
+    if args.gevent_isolation:
+        with app.app_context():
+            init_db()
+        problems = check_gevent_isolation(app, args.greenlets)
+        if problems:
+            for problem in problems:
+                print(f"✗ {problem}")
+            sys.exit(1)
+        print("\n✅ Each concurrent request had its own session and connection")
+        return
+
+    with app.app_context():
+        init_db()
+        plan = tree_sync.plan_sync(synthetic_tree(args.depth, args.fanout))
+        tree_sync.apply_sync(plan)
+        tree = tree_cache.refresh()
+        counter = QueryCounter(db.engine)
+        dialect = db.engine.dialect.name
+    print(f"✓ Synthetic tree: {len(tree)} questions (depth {args.depth}, fan-out {args.fanout})")
+
+    if args.url:
+        make_driver = lambda: HttpDriver(args.url)  # noqa: E731
+    else:
+        make_driver = lambda: TestClientDriver(app, counter)  # noqa: E731
+    flow = run_flow(make_driver, args.technicians, args.walks, args.seed)
+    telemetry.flush()
+    print(f"✓ Flow: {flow['sessions']} sessions, {flow['requests']} requests, "
+          f"p50 {flow['latency_ms'].get('p50')} ms, p99 {flow['latency_ms'].get('p99')} ms")
+
+    analytics = None
+    if args.sessions:
+        seed_sessions(app, tree, args.sessions)
+        analytics = run_analytics(app, counter, args.analytics_repeats)
+        print(f"✓ Analytics (30 days): p50 {analytics['last_30_days']['latency_ms']['p50']} ms")
+
+    result = {
+        'ran_at': datetime.utcnow().isoformat() + 'Z',
+        'commit': git_commit(),
+        'database': dialect,
+        'target': args.url or 'test client',
+        'config': {
+            'depth': args.depth,
+            'fanout': args.fanout,
+            'questions': len(tree),
+            'technicians': args.technicians,
+            'walks': args.walks,
+            'seeded_sessions': args.sessions,
+            'compact_session_history': app.config['COMPACT_SESSION_HISTORY'],
+            'telemetry_async': app.config['TELEMETRY_ASYNC']
+        },
+        'flow': flow,
+        'analytics': analytics
+    }
+    output = args.output or os.path.join(
+        'benchmark-results', datetime.utcnow().strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print()
+            compare(json.load(f), result)
+    if flow['errors']:
+        print(f"\n✗ {len(flow['errors'])} technician(s) hit errors: {flow['errors'][0]}")
+        sys.exit(1)
+    print(f"\n✅ Results written to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+Offline client bundle
+Compiles the decision tree into a versioned JSON file named after its content
+hash, precompressed with gzip (and brotli when the brotli package is installed),
+for the offline client in static/offline.
+
+The app builds the bundle for its current tree in memory (CompiledTree.offline_bundle)
+and serves it under /offline, so admin edits reach technicians the next time they are online. Run
+this file to write the same bundle to disk (e.g. for a CDN), either from the
+database or straight from decision_tree.yaml.
+
+Usage:
+    python bundle.py [output_dir]
+    python bundle.py --yaml decision_tree.yaml [output_dir]
+"""
+
+import gzip
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime
+from api import dumps, content_hash, tree_json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+Bundle = namedtuple('Bundle', ['version', 'hash', 'filename', 'encodings'])
+
+# Suffix of the precompressed copy of a file for each content encoding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def compress(body):
+    """Map of content encoding -> bytes, smallest first"""
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body, quality=11)
+    # mtime=0 keeps the gzip output identical for identical trees
+    encodings['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+    encodings['identity'] = body
+    return encodings
+
+def bundle_of(version, body, digest):
+    """Bundle for serialized tree JSON and its content hash"""
+    return Bundle(version, digest, f'tree.{digest}.json', compress(body))
+
+def build_bundle(document):
+    """Bundle for a tree document shaped like api.tree_json()"""
+    body = dumps(document)
+    return bundle_of(document['version'], body, content_hash(body))
+
+def yaml_document(questions_data):
+    """Tree document built straight from decision_tree.yaml (answers have no ids)"""
+    return {
+        'version': 0,
+        'start': 'start',
+        'questions': {
+            q_id: {
+                'text': q_data['text'],
+                'category': q_data.get('category') or '',
+                'answers': [
+                    {
+                        'id': None,
+                        'text': a['text'],
+                        'next': a.get('next'),
+                        'conclusion': a.get('conclusion')
+                    }
+                    for a in q_data.get('answers') or []
+                ]
+            }
+            for q_id, q_data in questions_data.items()
+        }
+    }
+
+def manifest(bundle):
+    """What the offline client fetches first to find the current tree file"""
+    return {'version': bundle.version, 'hash': bundle.hash, 'tree': bundle.filename}
+
+def choose_encoding(bundle, accept_encodings):
+    """Best precompressed encoding the client accepts"""
+    for encoding in bundle.encodings:
+        if encoding == 'identity' or encoding in accept_encodings:
+            return encoding
+
+def write_bundle(bundle, out_dir):
+    """Write the tree file, its compressed copies and manifest.json to out_dir"""
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for encoding, data in bundle.encodings.items():
+        path = os.path.join(out_dir, bundle.filename + ENCODING_SUFFIXES.get(encoding, ''))
+        with open(path, 'wb') as f:
+            f.write(data)
+        written.append(path)
+    path = os.path.join(out_dir, 'manifest.json')
+    with open(path, 'wb') as f:
+        f.write(dumps(dict(manifest(bundle), built_at=datetime.utcnow().isoformat() + 'Z')))
+    written.append(path)
+    return written
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--yaml']:
+        from tree_sync import load_yaml
+        source = args[1] if len(args) > 1 else 'decision_tree.yaml'
+        out_dir = args[2] if len(args) > 2 else os.path.join('dist', 'offline')
+        bundle = build_bundle(yaml_document(load_yaml(source)))
+    else:
+        from app import app
+        from tree_cache import load_tree
+        source = 'database'
+        out_dir = args[0] if args else os.path.join('dist', 'offline')
+        with app.app_context():
+            bundle = build_bundle(tree_json(load_tree()))
+
+    for path in write_bundle(bundle, out_dir):
+        print(f"✓ {path} ({os.path.getsize(path)} bytes)")
+    if brotli is None:
+        print("  (install the brotli package to also write .br files)")
+    print(f"\n✅ Bundle {bundle.hash} built from {source}")
@@ -0,0 +1,115 @@
+"""
+Shared conclusion texts
+Each distinct conclusion is stored once in the conclusions table. Answers and
+completed sessions refer to it by id, so analytics group on small integer keys
+and conclusion pages live at short URLs (/conclusion/<id>) instead of carrying
+the whole text in the query string.
+"""
+
+import hashlib
+from sqlalchemy import inspect, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Conclusion, Answer, TroubleshootingSession, SessionRollup
+
+def text_hash(conclusion_text):
+    """Hex sha256 that identifies a conclusion text"""
+    return hashlib.sha256(conclusion_text.encode('utf-8')).hexdigest()
+
+def ids_for(texts):
+    """text -> conclusion id for each non-empty text, inserting new ones in the caller's transaction"""
+    wanted = {text_hash(t): t for t in texts if t}
+    if not wanted:
+        return {}
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    db.session.execute(
+        dialect.insert(Conclusion).on_conflict_do_nothing(index_elements=['text_hash']),
+        [{'text': t, 'text_hash': digest} for digest, t in wanted.items()]
+    )
+    ids = dict(db.session.query(Conclusion.text_hash, Conclusion.id).filter(
+        Conclusion.text_hash.in_(list(wanted))
+    ))
+    return {t: ids[digest] for digest, t in wanted.items()}
+
+def id_for(conclusion_text):
+    """Conclusion id for a text, or None for no conclusion"""
+    return ids_for([conclusion_text]).get(conclusion_text)
+
+def _columns(table):
+    return {c['name'] for c in inspect(db.session.connection()).get_columns(table)}
+
+def convert_answers():
+    """Point answers at conclusion rows instead of their own copy of the text"""
+    if 'conclusion' not in _columns('answers'):
+        return 0
+    rows = db.session.execute(text('SELECT id, conclusion FROM answers WHERE conclusion IS NOT NULL')).all()
+    ids = ids_for(row.conclusion for row in rows)
+    updates = [{'id': row.id, 'conclusion_id': ids[row.conclusion]} for row in rows if row.conclusion]
+    if updates:
+        db.session.execute(update(Answer), updates)
+    db.session.execute(text('ALTER TABLE answers DROP COLUMN conclusion'))
+    return len(updates)
+
+def convert_sessions(chunk_size=5000):
+    """Move conclusion_reached text onto conclusion_id, returning the sessions converted"""
+    s = TroubleshootingSession
+    known = {}
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.query(s.id, s.conclusion_reached).filter(
+            s.id > last_id,
+            s.conclusion_reached.isnot(None)
+        ).order_by(s.id).limit(chunk_size).all()
+        if not rows:
+            break
+
+        known.update(ids_for({row.conclusion_reached for row in rows} - known.keys()))
+        by_conclusion = {}
+        for row in rows:
+            by_conclusion.setdefault(known.get(row.conclusion_reached), []).append(row.id)
+        # One UPDATE per distinct conclusion in the chunk; clearing the text lets a rerun resume
+        for conclusion_id, session_ids in by_conclusion.items():
+            db.session.execute(
+                update(s).where(s.id.in_(session_ids))
+                .values(conclusion_id=conclusion_id, conclusion_reached=None)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+
+        last_id = rows[-1].id
+        total += len(rows)
+        print(f"✓ Converted {total} session conclusions")
+    return total
+
+def convert_rollups():
+    """Re-key session_rollups on conclusion_id instead of the conclusion text"""
+    if 'conclusion' not in _columns('session_rollups'):
+        return
+    texts = [t for (t,) in db.session.execute(
+        text("SELECT DISTINCT conclusion FROM session_rollups WHERE conclusion != ''"))]
+    ids = ids_for(texts)
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ALTER TABLE session_rollups ADD COLUMN IF NOT EXISTS conclusion_id INTEGER NOT NULL DEFAULT 0'))
+        db.session.execute(
+            text('UPDATE session_rollups SET conclusion_id = :id WHERE conclusion = :text'),
+            [{'id': conclusion_id, 'text': t} for t, conclusion_id in ids.items()]
+        )
+        db.session.execute(text('ALTER TABLE session_rollups DROP CONSTRAINT uq_session_rollups_key'))
+        db.session.execute(text('ALTER TABLE session_rollups DROP COLUMN conclusion'))
+        db.session.execute(text(
+            'ALTER TABLE session_rollups ADD CONSTRAINT uq_session_rollups_key '
+            'UNIQUE (grain, bucket, category, conclusion_id)'
+        ))
+        return
+
+    # SQLite can't drop a column that is part of a UNIQUE constraint: copy into a new table
+    db.session.execute(text('ALTER TABLE session_rollups RENAME TO session_rollups_old'))
+    SessionRollup.__table__.create(db.session.connection())
+    columns = ', '.join(c.name for c in SessionRollup.__table__.columns if c.name != 'conclusion_id')
+    db.session.execute(text(
+        f'INSERT INTO session_rollups ({columns}, conclusion_id) '
+        f'SELECT {columns}, COALESCE((SELECT c.id FROM conclusions c WHERE c.text = o.conclusion), 0) '
+        f'FROM session_rollups_old o'
+    ))
+    db.session.execute(text('DROP TABLE session_rollups_old'))
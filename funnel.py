@@ -0,0 +1,157 @@
+"""
+Per-edge path funnel analytics
+Streams session_steps with a server-side cursor and counts traversals
+per (question, answer) edge plus reach/drop-off and time to answer per question, then materializes
+the result in funnel_edges / funnel_nodes for the admin funnel page.
+
+Run this file to recompute the funnel from the command line.
+"""
+
+from collections import Counter
+from datetime import datetime
+from itertools import groupby
+from sqlalchemy import exists, func, insert
+from models import db, TroubleshootingSession, SessionStep, FunnelEdge, FunnelNode
+
+def compute_funnel(tree, chunk_size=1000):
+    """Stream every recorded path and count edge traversals and drop-offs"""
+    s = TroubleshootingSession
+    st = SessionStep
+
+    edges = Counter()
+    answered = Counter()
+    dropped = Counter()
+    seconds = Counter()
+    timed = Counter()
+    sessions = 0
+
+    # yield_per streams rows through a server-side cursor in constant memory;
+    # the (session_id, position) primary key keeps each session's steps together
+    rows = db.session.query(
+        st.session_id, st.position, st.answer_id, st.question_text, st.answer_text, st.answered_at,
+        s.started_at, s.abandoned
+    ).join(
+        s, s.session_id == st.session_id
+    ).order_by(st.session_id, st.position).execution_options(yield_per=chunk_size)
+
+    for _, steps in groupby(rows, key=lambda row: row.session_id):
+        sessions += 1
+        previous_at = None
+        for step in steps:
+            answer = tree.answers.get(step.answer_id) if step.answer_id is not None else None
+            if answer:
+                question_id = tree.question_for_answer(answer).question_id
+                edges[(question_id, answer.id)] += 1
+                answered[question_id] += 1
+                # Time since the previous answer, or since the session started for the first
+                shown_at = previous_at if step.position else step.started_at
+                if step.answered_at and shown_at:
+                    seconds[question_id] += (step.answered_at - shown_at).total_seconds()
+                    timed[question_id] += 1
+            else:
+                # Text-only steps, and answers deleted since
+                edges[(None, None, step.question_text or '', step.answer_text or '')] += 1
+            previous_at = step.answered_at
+
+        # An abandoned session dropped off on the question after its last answer
+        if step.abandoned and answer and answer.next_question_id:
+            dropped[answer.next_question_id] += 1
+
+    # Sessions that never answered anything have no steps and stopped on the question they opened on
+    dropped.update(dict(db.session.query(
+        func.coalesce(s.entry_question, 'start'), func.count()
+    ).filter(
+        ~exists().where(st.session_id == s.session_id),
+        s.abandoned.is_(True)
+    ).group_by(s.entry_question)))
+
+    return {
+        'sessions': sessions,
+        'edges': edges,
+        'answered': answered,
+        'dropped': +dropped,
+        'seconds': seconds,
+        'timed': timed
+    }
+
+def materialize(tree, result):
+    """Replace the funnel tables with a freshly computed result"""
+    computed_at = datetime.utcnow()
+    edge_rows = []
+    for key, traversals in result['edges'].items():
+        if key[0] is None:
+            _, _, question_text, answer_text = key
+            edge_rows.append({
+                'question_id': None,
+                'answer_id': None,
+                'question_text': question_text,
+                'answer_text': answer_text,
+                'traversals': traversals,
+                'computed_at': computed_at
+            })
+        else:
+            question_id, answer_id = key
+            edge_rows.append({
+                'question_id': question_id,
+                'answer_id': answer_id,
+                'question_text': tree.get_question(question_id).text,
+                'answer_text': tree.answers[answer_id].text,
+                'traversals': traversals,
+                'computed_at': computed_at
+            })
+
+    node_rows = [
+        {
+            'question_id': question_id,
+            'reached': result['answered'][question_id] + result['dropped'][question_id],
+            'answered': result['answered'][question_id],
+            'dropped': result['dropped'][question_id],
+            'answer_seconds': result['seconds'][question_id],
+            'timed_answers': result['timed'][question_id],
+            'computed_at': computed_at
+        }
+        for question_id in set(result['answered']) | set(result['dropped'])
+    ]
+
+    # One transaction, so the admin page sees either the old or the new funnel
+    FunnelEdge.query.delete()
+    FunnelNode.query.delete()
+    if edge_rows:
+        db.session.execute(insert(FunnelEdge), edge_rows)
+    if node_rows:
+        db.session.execute(insert(FunnelNode), node_rows)
+    db.session.commit()
+
+def refresh_funnel(tree):
+    """Recompute and store the funnel, returning the number of sessions read"""
+    result = compute_funnel(tree)
+    materialize(tree, result)
+    return result['sessions']
+
+def tree_order(tree):
+    """Questions in depth-first order from start, then anything unreachable"""
+    ordered = []
+    seen = set()
+    stack = ['start']
+    while stack:
+        question = tree.get_question(stack.pop())
+        if not question or question.question_id in seen:
+            continue
+        seen.add(question.question_id)
+        ordered.append(question)
+        stack.extend(a.next_question_id for a in reversed(question.answers) if a.next_question_id)
+    ordered.extend(sorted(
+        (q for q in tree.questions.values() if q.question_id not in seen),
+        key=lambda q: q.question_id
+    ))
+    return ordered
+
+if __name__ == '__main__':
+    from app import app
+    from tree_cache import load_tree
+
+    print("Computing path funnel...")
+    with app.app_context():
+        db.create_all()
+        sessions = refresh_funnel(load_tree())
+    print(f"\n✅ Funnel computed from {sessions} sessions")
@@ -0,0 +1,38 @@
+"""
+Gunicorn settings
+Gunicorn reads this file automatically from the working directory, so the
+existing `gunicorn app:app` start command picks it up.
+
+The default sync workers handle one request at a time each. For hundreds of
+concurrent technicians on one instance, install requirements-gevent.txt and set
+GUNICORN_WORKER_CLASS=gevent: each worker then serves up to
+GUNICORN_WORKER_CONNECTIONS requests as greenlets, and psycopg2 is patched so a
+slow Supabase query only parks its own greenlet. Size DB_POOL_SIZE and
+DB_MAX_OVERFLOW for the concurrent queries you expect per worker.
+"""
+
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+
+# Unset variables keep gunicorn's own defaults (1 worker, or WEB_CONCURRENCY,
+# which gunicorn reads itself; 1000 connections; 30 s timeout; 2 s keepalive)
+if os.environ.get('WEB_CONCURRENCY'):
+    workers = int(os.environ['WEB_CONCURRENCY'])
+if os.environ.get('GUNICORN_WORKER_CONNECTIONS'):
+    worker_connections = int(os.environ['GUNICORN_WORKER_CONNECTIONS'])
+if os.environ.get('GUNICORN_TIMEOUT'):
+    timeout = int(os.environ['GUNICORN_TIMEOUT'])
+if os.environ.get('GUNICORN_KEEPALIVE'):
+    keepalive = int(os.environ['GUNICORN_KEEPALIVE'])
+
+# Load the app in each worker after gevent has patched it, never in the master:
+# the engine pool, telemetry writer and sweeper must not be shared across a fork
+preload_app = False
+
+def post_fork(server, worker):
+    if worker_class == 'gevent' and os.environ.get('DATABASE_URL', '').startswith('postgres'):
+        # psycopg2 waits for Postgres in C; the wait callback yields to the gevent hub instead
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+        server.log.info('psycopg2 made gevent-cooperative in worker %s', worker.pid)
@@ -0,0 +1,256 @@
+"""
+Request instrumentation
+Times every request and splits it into database time (SQLAlchemy cursor
+events), template rendering and session cookie handling. Responses to admins
+and to requests bearing METRICS_TOKEN carry a Server-Timing header, per-endpoint histograms are exported in Prometheus text
+format at /metrics (only when METRICS_TOKEN is set, to scrapers sending it as a
+bearer token), and requests slower than SLOW_REQUEST_MS are logged with their
+slowest SQL statements.
+
+Histograms live in process memory: with several gunicorn workers, each scrape
+reports the worker that answered it.
+"""
+
+import bisect
+import hmac
+import threading
+import time
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from flask.sessions import SessionInterface
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Statements kept per request for the slow-request log, and how many get logged
+TRACKED_STATEMENTS = 50
+LOGGED_STATEMENTS = 5
+
+class Histogram:
+    """Prometheus-style histogram with one series per endpoint"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        """Record one value"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._series[endpoint] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        """Lines of Prometheus text exposition format"""
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = {endpoint: list(series) for endpoint, series in self._series.items()}
+        for endpoint, series in sorted(snapshot.items()):
+            label = 'endpoint="' + endpoint.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            cumulative = 0
+            for le, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+class RequestStats:
+    """Timings gathered while one request is handled"""
+    __slots__ = ('started', 'queries', 'db', 'render', 'render_started', 'session', 'statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.render_started = None
+        self.session = 0.0
+        self.statements = []
+
+def _current_stats():
+    return g.get('_request_stats') if has_request_context() else None
+
+class TimedSessionInterface(SessionInterface):
+    """Wraps the app's session interface to time cookie decoding and signing"""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def is_null_session(self, obj):
+        return self.inner.is_null_session(obj)
+
+    def make_null_session(self, app):
+        return self.inner.make_null_session(app)
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        session = self.inner.open_session(app, request)
+        # Runs before before_request, so keep the time until the stats exist
+        g._session_open_seconds = time.perf_counter() - started
+        return session
+
+    def save_session(self, app, session, response):
+        started = time.perf_counter()
+        self.inner.save_session(app, session, response)
+        stats = _current_stats()
+        if stats is not None:
+            stats.session += time.perf_counter() - started
+            if 'Server-Timing' in response.headers:
+                response.headers['Server-Timing'] += f', session;dur={stats.session * 1000:.1f}'
+
+class Metrics:
+    """Per-request timing, Server-Timing headers and a Prometheus /metrics endpoint"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.slow_request_seconds = 0
+        self.token = None
+        self.logger = None
+        self.values = []
+        self.timing_visible = None
+        self.request_seconds = Histogram(
+            'troubleshooting_request_duration_seconds', 'Time to handle a request', DURATION_BUCKETS)
+        self.db_seconds = Histogram(
+            'troubleshooting_request_db_seconds', 'Time spent in SQL per request', DURATION_BUCKETS)
+        self.render_seconds = Histogram(
+            'troubleshooting_request_render_seconds', 'Time spent rendering templates per request', DURATION_BUCKETS)
+        self.queries = Histogram(
+            'troubleshooting_request_queries', 'SQL statements per request', QUERY_BUCKETS)
+        self.response_bytes = Histogram(
+            'troubleshooting_response_size_bytes', 'Response body size', SIZE_BUCKETS)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Install the hooks if METRICS_ENABLED, and the /metrics route if METRICS_TOKEN is set too"""
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.slow_request_seconds = app.config.get('SLOW_REQUEST_MS', 0) / 1000
+        self.token = app.config.get('METRICS_TOKEN')
+        self.logger = app.logger
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.session_interface = TimedSessionInterface(app.session_interface)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        # Request and database stats are never public
+        if self.token:
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def show_timing_to(self, check):
+        """Also send Server-Timing when check() is true for the current request (e.g. admins)"""
+        self.timing_visible = check
+
+    def _has_token(self):
+        supplied = request.headers.get('Authorization', '').encode('utf-8')
+        return bool(self.token) and hmac.compare_digest(supplied, f'Bearer {self.token}'.encode('utf-8'))
+
+    def _shows_timing(self):
+        # SQL time and query counts say too much about the backend to hand to everyone
+        return self._has_token() or bool(self.timing_visible and self.timing_visible())
+
+    def add_value(self, name, help_text, read, kind='gauge'):
+        """Export read() as a gauge (or counter) on every scrape"""
+        self.values.append((name, help_text, read, kind))
+
+    # SQLAlchemy events
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+        # Telemetry and sweeper threads run queries outside any request
+        stats = _current_stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.db += elapsed
+            if self.slow_request_seconds and len(stats.statements) < TRACKED_STATEMENTS:
+                stats.statements.append((elapsed, statement))
+
+    # Template signals
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = _current_stats()
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = _current_stats()
+        if stats is not None and stats.render_started is not None:
+            stats.render += time.perf_counter() - stats.render_started
+            stats.render_started = None
+
+    # Request hooks
+
+    def _before_request(self):
+        stats = RequestStats()
+        stats.session = g.pop('_session_open_seconds', 0.0)
+        g._request_stats = stats
+
+    def _after_request(self, response):
+        stats = _current_stats()
+        if stats is not None:
+            if self._shows_timing():
+                app_seconds = time.perf_counter() - stats.started
+                response.headers['Server-Timing'] = (
+                    f'app;dur={app_seconds * 1000:.1f}, '
+                    f'db;dur={stats.db * 1000:.1f};desc="{stats.queries} queries", '
+                    f'render;dur={stats.render * 1000:.1f}'
+                )
+            # None for streamed bodies
+            g._response_size = response.content_length
+        return response
+
+    def _teardown_request(self, exc=None):
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return
+        total = time.perf_counter() - stats.started + stats.session
+        endpoint = request.endpoint or 'unmatched'
+        self.request_seconds.observe(endpoint, total)
+        self.db_seconds.observe(endpoint, stats.db)
+        self.render_seconds.observe(endpoint, stats.render)
+        self.queries.observe(endpoint, stats.queries)
+        size = g.pop('_response_size', None)
+        if size is not None:
+            self.response_bytes.observe(endpoint, size)
+
+        if self.slow_request_seconds and total >= self.slow_request_seconds:
+            slowest = sorted(stats.statements, key=lambda s: s[0], reverse=True)[:LOGGED_STATEMENTS]
+            self.logger.warning(
+                'Slow request %s %s (%s): %.0f ms total, %.0f ms in %d queries, %.0f ms rendering%s',
+                request.method, request.path, endpoint, total * 1000, stats.db * 1000, stats.queries,
+                stats.render * 1000,
+                ''.join(f'\n  {seconds * 1000:.1f} ms: {" ".join(sql.split())[:500]}' for seconds, sql in slowest)
+            )
+
+    # Exposition
+
+    def metrics_view(self):
+        """Prometheus text format"""
+        if not self._has_token():
+            abort(401)
+        lines = []
+        for histogram in (self.request_seconds, self.db_seconds, self.render_seconds,
+                          self.queries, self.response_bytes):
+            lines.extend(histogram.render())
+        for name, help_text, read, kind in self.values:
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {read()}'])
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+metrics = Metrics()
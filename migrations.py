@@ -0,0 +1,224 @@
+"""
+Schema migrations and query plan checks
+db.create_all() only creates missing tables; it never adds indexes or columns
+to tables that already exist. Each migration below runs once per database and
+is recorded in the schema_migrations table. Migrations are written to be
+harmless on a database that create_all() has already brought up to date.
+
+Usage:
+    python migrations.py            Apply pending migrations
+    python migrations.py status     List applied and pending migrations
+    python migrations.py explain    Check that the hot queries use indexes
+"""
+
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Question, Answer, Conclusion, TroubleshootingSession, SessionRollup, SessionStep, SchemaMigration
+import conclusions
+from session_steps import convert_path_taken
+from search import GIN_INDEXES
+from tree_cache import load_tree
+
+MIGRATIONS = []
+
+def migration(migration_id):
+    """Register a migration function under a unique, ordered id"""
+    def register(f):
+        MIGRATIONS.append((migration_id, f))
+        return f
+    return register
+
+def _dialect():
+    return db.engine.dialect.name
+
+def add_column(table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists"""
+    existing = {c['name'] for c in inspect(db.session.connection()).get_columns(table)}
+    if column not in existing:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+def create_index(name, table, columns, where=None):
+    """CREATE INDEX IF NOT EXISTS (supported by both Postgres and SQLite)"""
+    sql = f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'
+    if where:
+        sql += f' WHERE {where}'
+    db.session.execute(text(sql))
+
+@migration('0001_create_new_tables')
+def create_new_tables():
+    # tree_version, session_rollups, funnel_* and schema_migrations itself
+    db.metadata.create_all(db.session.connection())
+
+@migration('0002_answers_question_order_index')
+def answers_question_order_index():
+    create_index('ix_answers_question_id_order', 'answers', 'question_id, "order"')
+
+@migration('0003_sessions_started_at_index')
+def sessions_started_at_index():
+    create_index('ix_sessions_started_at', 'troubleshooting_sessions', 'started_at DESC')
+
+@migration('0004_sessions_open_index')
+def sessions_open_index():
+    where = 'abandoned = false' if _dialect() == 'postgresql' else 'abandoned = 0'
+    create_index('ix_sessions_open_started', 'troubleshooting_sessions', 'completed_at, started_at', where)
+
+@migration('0005_session_steps')
+def session_steps_table():
+    SessionStep.__table__.create(db.session.connection(), checkfirst=True)
+    create_index('ix_session_steps_answer_id', 'session_steps', 'answer_id')
+    # load_tree() reads through today's models, which join the conclusions table and read questions.version
+    conclusion_columns()
+    question_version_column()
+    # Commits chunk by chunk; rows already converted have path_taken cleared, so a rerun resumes
+    convert_path_taken(load_tree())
+
+@migration('0006_funnel_node_timing')
+def funnel_node_timing():
+    add_column('funnel_nodes', 'answer_seconds', 'FLOAT NOT NULL DEFAULT 0')
+    add_column('funnel_nodes', 'timed_answers', 'INTEGER NOT NULL DEFAULT 0')
+
+@migration('0007_search_indexes')
+def search_indexes():
+    # SQLite searches an in-memory index built from the compiled tree instead
+    if _dialect() != 'postgresql':
+        return
+    tables = inspect(db.session.connection())
+    for name, table, expression in GIN_INDEXES:
+        # The conclusions index waits for 0008 on databases that predate that table
+        if tables.has_table(table):
+            db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} USING GIN ({expression})'))
+
+def conclusion_columns():
+    """The conclusions table and the columns referring to it (no data moved)"""
+    Conclusion.__table__.create(db.session.connection(), checkfirst=True)
+    add_column('answers', 'conclusion_id', 'INTEGER REFERENCES conclusions (id)')
+    add_column('troubleshooting_sessions', 'conclusion_id', 'INTEGER REFERENCES conclusions (id)')
+
+@migration('0008_conclusions_table')
+def conclusions_table():
+    conclusion_columns()
+    conclusions.convert_answers()
+    conclusions.convert_rollups()
+    # Commits chunk by chunk; converted rows have conclusion_reached cleared, so a rerun resumes
+    conclusions.convert_sessions()
+    search_indexes()
+
+def question_version_column():
+    """questions.version, checked by batch answer edits"""
+    add_column('questions', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+@migration('0009_question_versions')
+def question_versions():
+    question_version_column()
+
+@migration('0010_sessions_conclusion_index')
+def sessions_conclusion_index():
+    create_index('ix_sessions_conclusion_id', 'troubleshooting_sessions', 'conclusion_id')
+
+@migration('0011_sessions_entry_question')
+def sessions_entry_question():
+    add_column('troubleshooting_sessions', 'entry_question', 'VARCHAR(100)')
+
+def applied_migrations():
+    """Ids of migrations already recorded in this database"""
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return set()
+    return {row.id for row in SchemaMigration.query.all()}
+
+def upgrade():
+    """Apply pending migrations, each in its own transaction"""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = applied_migrations()
+    ran = []
+    for migration_id, f in MIGRATIONS:
+        if migration_id in applied:
+            continue
+        f()
+        db.session.add(SchemaMigration(id=migration_id))
+        db.session.commit()
+        ran.append(migration_id)
+        print(f"✓ Applied {migration_id}")
+    return ran
+
+def hot_queries():
+    """The lookups the app runs on every request or dashboard load"""
+    s = TroubleshootingSession
+    r = SessionRollup
+    now = datetime.utcnow()
+    return {
+        'question by question_id': Question.query.filter(Question.question_id == 'start'),
+        'answers of a question in order': Answer.query.filter(Answer.question_id == 1).order_by(Answer.order),
+        'session by session_id': s.query.filter(s.session_id == 'x'),
+        'steps of a session': SessionStep.query.filter(SessionStep.session_id == 'x').order_by(SessionStep.position),
+        'steps of an answer': SessionStep.query.filter(SessionStep.answer_id == 1),
+        'sessions reaching a conclusion': db.session.query(s.id).filter(s.conclusion_id == 1).limit(1),
+        'recent sessions': s.query.order_by(s.started_at.desc()).limit(20),
+        'sessions in date range': db.session.query(s.started_at, s.completed_at).filter(
+            s.completed_at.isnot(None), s.started_at >= now - timedelta(days=30), s.started_at < now),
+        'sweeper candidates': db.session.query(s.id).filter(
+            s.completed_at.is_(None), s.abandoned == False, s.started_at < now  # noqa: E712
+        ).order_by(s.started_at).limit(1000),
+        'rollups in date range': db.session.query(r.sessions_started).filter(
+            r.grain == 'day', r.bucket >= now - timedelta(days=30), r.bucket < now),
+    }
+
+def _sql(query):
+    return str(query.statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+def _plan_uses_index(node):
+    """True if a Postgres JSON plan (or any child) reads through an index"""
+    if node.get('Node Type') in ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'):
+        return True
+    return any(_plan_uses_index(child) for child in node.get('Plans', []))
+
+def explain(query):
+    """Return (uses_index, plan text) for a query on the current database"""
+    sql = _sql(query)
+    if _dialect() == 'postgresql':
+        # Tiny tables make a sequential scan cheapest; we only want to know an index is usable
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        plan = db.session.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()[0]['Plan']
+        db.session.rollback()
+        return _plan_uses_index(plan), plan['Node Type']
+
+    details = [row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    full_scans = [d for d in details if d.startswith('SCAN') and 'USING' not in d]
+    return not full_scans, '; '.join(details)
+
+def check_query_plans():
+    """Explain every hot query, returning the names of those that don't use an index"""
+    failures = []
+    for name, query in hot_queries().items():
+        try:
+            uses_index, plan = explain(query)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            uses_index, plan = False, f'error: {e.orig}'
+        print(f"{'✓' if uses_index else '✗'} {name}: {plan}")
+        if not uses_index:
+            failures.append(name)
+    return failures
+
+if __name__ == '__main__':
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    with app.app_context():
+        if command == 'upgrade':
+            ran = upgrade()
+            print(f"\n✅ {len(ran)} migration(s) applied")
+        elif command == 'status':
+            applied = applied_migrations()
+            for migration_id, _ in MIGRATIONS:
+                print(f"{'✓' if migration_id in applied else ' '} {migration_id}")
+        elif command == 'explain':
+            failures = check_query_plans()
+            if failures:
+                print(f"\n✗ {len(failures)} hot quer{'y' if len(failures) == 1 else 'ies'} not using an index")
+                sys.exit(1)
+            print("\n✅ All hot queries use an index")
+        else:
+            print(__doc__)
+            sys.exit(2)
@@ -42,6 +42,7 @@ class Question(db.Model):
     question_id = db.Column(db.String(100), unique=True, nullable=False)
     text = db.Column(db.Text, nullable=False)
     category = db.Column(db.String(50))
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped by every edit to the question or its answers
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
     # Relationship to answers
@@ -52,34 +53,71 @@ class Question(db.Model):
 
 class Answer(db.Model):
     __tablename__ = 'answers'
+    __table_args__ = (
+        # Ordered answers of one question
+        db.Index('ix_answers_question_id_order', 'question_id', 'order'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), nullable=False)
     text = db.Column(db.Text, nullable=False)
     next_question_id = db.Column(db.String(100))  # question_id of next question, or NULL
-    conclusion = db.Column(db.Text)  # Final conclusion text, or NULL
+    conclusion_id = db.Column(db.Integer, db.ForeignKey('conclusions.id'))  # Final conclusion, or NULL
     order = db.Column(db.Integer, default=0)  # Display order
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     
+    conclusion = db.relationship('Conclusion', lazy='joined')
+    
     def __repr__(self):
         return f'<Answer {self.id} for Question {self.question_id}>'
 
+class Conclusion(db.Model):
+    """One distinct conclusion text, shared by every answer and session that reaches it"""
+    __tablename__ = 'conclusions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    text_hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of text; TEXT itself is too long to index
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+    
+    def __repr__(self):
+        return f'<Conclusion {self.id}>'
+
 class TroubleshootingSession(db.Model):
     __tablename__ = 'troubleshooting_sessions'
+    __table_args__ = (
+        # Sweeper lookups: unfinished sessions not yet marked abandoned, oldest first
+        db.Index(
+            'ix_sessions_open_started', 'completed_at', 'started_at',
+            postgresql_where=db.text('abandoned = false'),
+            sqlite_where=db.text('abandoned = 0')
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), unique=True, nullable=False)  # Unique session identifier
     started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
-    path_taken = db.Column(db.JSON)  # List of {question, answer} dicts
-    conclusion_reached = db.Column(db.Text)
+    path_taken = db.Column(db.JSON)  # Legacy {question, answer} list; paths now live in session_steps
+    conclusion_id = db.Column(db.Integer, db.ForeignKey('conclusions.id'))
+    conclusion_reached = db.Column(db.Text)  # Legacy conclusion text; archived sessions still carry it
+    entry_question = db.Column(db.String(100))  # question_id a search result opened the session on; NULL for start
     ip_address = db.Column(db.String(50))
     user_agent = db.Column(db.String(500))
     abandoned = db.Column(db.Boolean, default=False)  # True if user didn't complete
     
+    conclusion = db.relationship('Conclusion', lazy='joined')
+    
     def __repr__(self):
         return f'<TroubleshootingSession {self.session_id}>'
     
+    @property
+    def conclusion_text(self):
+        """Text of the conclusion reached, or None"""
+        if self.conclusion:
+            return self.conclusion.text
+        return self.conclusion_reached
+    
     @property
     def duration_seconds(self):
         """Calculate session duration in seconds"""
@@ -90,4 +128,105 @@ class TroubleshootingSession(db.Model):
     @property
     def question_count(self):
         """Number of questions answered"""
-        return len(self.path_taken) if self.path_taken else 0
\ No newline at end of file
+        return len(self.path_taken) if self.path_taken else 0
+
+# Recent-sessions list and date-range filters
+db.Index('ix_sessions_started_at', TroubleshootingSession.started_at.desc())
+
+# Old conclusion pages are only served while some session reached them
+db.Index('ix_sessions_conclusion_id', TroubleshootingSession.conclusion_id)
+
+class SessionStep(db.Model):
+    """One answered question of a troubleshooting session"""
+    __tablename__ = 'session_steps'
+    
+    session_id = db.Column(db.String(100), primary_key=True)  # troubleshooting_sessions.session_id
+    position = db.Column(db.Integer, primary_key=True)  # 0 for the answer to the start question
+    answer_id = db.Column(db.Integer)  # answers.id, kept after the answer is deleted
+    question_text = db.Column(db.Text)  # Only when answer_id can't be joined to the answers table
+    answer_text = db.Column(db.Text)
+    answered_at = db.Column(db.DateTime)  # NULL for steps converted from path_taken
+    
+    def __repr__(self):
+        return f'<SessionStep {self.session_id} #{self.position}>'
+
+# Steps to update before an answer is deleted
+db.Index('ix_session_steps_answer_id', SessionStep.answer_id)
+
+class TreeVersion(db.Model):
+    """Single-row counter bumped by every decision tree edit"""
+    __tablename__ = 'tree_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
+    
+    def __repr__(self):
+        return f'<TreeVersion {self.version}>'
+
+class SessionRollup(db.Model):
+    """Session counts pre-aggregated per hour/day, conclusion and first-level category"""
+    __tablename__ = 'session_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket', 'category', 'conclusion_id', name='uq_session_rollups_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(10), nullable=False)  # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, nullable=False)  # Start of the hour/day (UTC)
+    category = db.Column(db.String(100), nullable=False, default='')  # Answer to the start question
+    conclusion_id = db.Column(db.Integer, nullable=False, default=0)  # conclusions.id, 0 for none
+    sessions_started = db.Column(db.Integer, nullable=False, default=0)
+    sessions_completed = db.Column(db.Integer, nullable=False, default=0)
+    sessions_abandoned = db.Column(db.Integer, nullable=False, default=0)
+    total_questions = db.Column(db.Integer, nullable=False, default=0)  # Summed over completed sessions
+    total_duration_seconds = db.Column(db.Float, nullable=False, default=0)  # Summed over completed sessions
+    
+    def __repr__(self):
+        return f'<SessionRollup {self.grain} {self.bucket}>'
+
+class FunnelEdge(db.Model):
+    """Materialized traversal count of one (question, answer) edge"""
+    __tablename__ = 'funnel_edges'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.String(100))  # NULL if the recorded step no longer matches the tree
+    answer_id = db.Column(db.Integer)  # NULL if the recorded step no longer matches the tree
+    question_text = db.Column(db.Text, nullable=False)
+    answer_text = db.Column(db.Text, nullable=False)
+    traversals = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<FunnelEdge {self.question_id}/{self.answer_id} x{self.traversals}>'
+
+class FunnelNode(db.Model):
+    """Materialized reach and drop-off counts for one question"""
+    __tablename__ = 'funnel_nodes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.String(100), nullable=False)
+    reached = db.Column(db.Integer, nullable=False, default=0)  # Sessions that were shown the question
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    dropped = db.Column(db.Integer, nullable=False, default=0)  # Sessions abandoned on the question
+    answer_seconds = db.Column(db.Float, nullable=False, default=0)  # Summed time before each timed answer
+    timed_answers = db.Column(db.Integer, nullable=False, default=0)  # Answers with a recorded time
+    computed_at = db.Column(db.DateTime, nullable=False)
+    
+    @property
+    def average_seconds(self):
+        """Average time technicians spent on the question before answering"""
+        return self.answer_seconds / self.timed_answers if self.timed_answers else None
+    
+    def __repr__(self):
+        return f'<FunnelNode {self.question_id}>'
+
+class SchemaMigration(db.Model):
+    """Migrations from migrations.py that have been applied"""
+    __tablename__ = 'schema_migrations'
+    
+    id = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.id}>'
\ No newline at end of file
@@ -0,0 +1,365 @@
+"""
+Session retention and archival
+Sessions older than SESSION_RETENTION_DAYS, with their steps joined back to
+question and answer text, are copied to gzip-compressed JSONL files under
+SESSION_ARCHIVE_DIR and then removed from troubleshooting_sessions and session_steps,
+one chunk at a time, so the table (and every query over it) stays bounded.
+Each chunk file is written and listed in an on-disk SQLite index before its
+rows are deleted; the admin session view uses the index to open archived
+sessions by session_id. Rollups for archived days are kept, so analytics
+totals still cover them.
+
+On Postgres the table can instead be partitioned by month on started_at
+(`python retention.py partition`, once, during a quiet period). Expired months
+are then archived and dropped as whole partitions instead of deleted row by row.
+Upcoming months' partitions are created by every archiver run and by
+`python retention.py partitions`; sessions that reached the default partition
+in the meantime are moved into their month's partition when it is created.
+
+Usage:
+    python retention.py                    Archive sessions older than the retention period
+    python retention.py partition          Convert troubleshooting_sessions to monthly partitions (Postgres)
+    python retention.py partitions         Create the coming months' partitions (Postgres)
+    python retention.py find <session_id>  Print an archived session
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import delete, text, tuple_
+from models import db, TroubleshootingSession, SessionStep
+from rollups import bucket_start
+from session_steps import paths_for
+from tree_cache import tree_cache
+
+ARCHIVE_COLUMNS = (
+    'session_id',
+    'started_at',
+    'completed_at',
+    'path_taken',
+    'conclusion_reached',
+    'entry_question',
+    'ip_address',
+    'user_agent',
+    'abandoned'
+)
+DATETIME_COLUMNS = ('started_at', 'completed_at')
+
+INDEX_FILE = 'index.sqlite3'
+
+# Monthly partitions are created this far ahead of the current month
+PARTITION_MONTHS_AHEAD = 3
+
+SESSIONS_TABLE = TroubleshootingSession.__tablename__
+
+# Archive files
+
+def to_record(row, path=None):
+    """JSON-serializable dict of one session row, its path stored as text"""
+    record = {name: getattr(row, name) for name in ARCHIVE_COLUMNS}
+    # Archives keep the text, so they don't depend on the conclusions table
+    record['conclusion_reached'] = row.conclusion_text
+    for name in DATETIME_COLUMNS:
+        if record[name] is not None:
+            record[name] = record[name].isoformat()
+    if path:
+        record['path_taken'] = [
+            dict(step, answered_at=step['answered_at'].isoformat() if step['answered_at'] else None)
+            for step in path
+        ]
+    return record
+
+def from_record(record):
+    """Detached TroubleshootingSession for an archived record (never added to the db session)"""
+    fields = {name: record.get(name) for name in ARCHIVE_COLUMNS}
+    for name in DATETIME_COLUMNS:
+        if fields[name] is not None:
+            fields[name] = datetime.fromisoformat(fields[name])
+    return TroubleshootingSession(**fields)
+
+def write_archive_file(directory, records):
+    """Write records to a new .jsonl.gz file, returning its name once it is safely on disk"""
+    filename = f"sessions-{records[0]['started_at'][:10]}-{records[0]['session_id'][:8]}-{len(records)}.jsonl.gz"
+    path = os.path.join(directory, filename)
+    partial = path + '.partial'
+    with open(partial, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(partial, path)
+    return filename
+
+class ArchiveIndex:
+    """session_id -> (file, line) of every archived session"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.db = sqlite3.connect(os.path.join(directory, INDEX_FILE))
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS archived_sessions ('
+            'session_id TEXT PRIMARY KEY, file TEXT NOT NULL, line INTEGER NOT NULL, started_at TEXT)'
+        )
+
+    def add(self, filename, records):
+        # A chunk archived twice (e.g. after a crash before its delete) points at the newer copy
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO archived_sessions VALUES (?, ?, ?, ?)',
+                [(r['session_id'], filename, line, r['started_at']) for line, r in enumerate(records)]
+            )
+
+    def find(self, session_id):
+        return self.db.execute(
+            'SELECT file, line FROM archived_sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+
+    def close(self):
+        self.db.close()
+
+def find_archived_session(directory, session_id):
+    """Archived session as a detached TroubleshootingSession, or None"""
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        return None
+    index = ArchiveIndex(directory)
+    try:
+        found = index.find(session_id)
+    finally:
+        index.close()
+    if found is None:
+        return None
+
+    filename, line = found
+    with gzip.open(os.path.join(directory, filename), 'rb') as f:
+        for number, raw in enumerate(f):
+            if number == line:
+                return from_record(json.loads(raw))
+    return None
+
+# Archival
+
+def retention_cutoff(retention_days, now=None):
+    """Sessions started before this are archived; whole days, so no day's rollups are split"""
+    return bucket_start((now or datetime.utcnow()) - timedelta(days=retention_days), 'day')
+
+def archive_sessions(directory, cutoff, chunk_size=1000, delete_rows=True):
+    """Archive sessions started before cutoff, deleting each chunk once written; returns the count"""
+    s = TroubleshootingSession
+    # Text as it reads now: archives outlive the answers they refer to
+    tree = tree_cache.get()
+    os.makedirs(directory, exist_ok=True)
+    index = ArchiveIndex(directory)
+    total = 0
+    last = None
+    try:
+        while True:
+            query = s.query.filter(s.started_at < cutoff)
+            if last is not None:
+                query = query.filter(tuple_(s.started_at, s.id) > last)
+            rows = query.order_by(s.started_at, s.id).limit(chunk_size).all()
+            if not rows:
+                break
+
+            paths = paths_for([(row.session_id, row.started_at) for row in rows], tree)
+            records = [to_record(row, paths.get(row.session_id)) for row in rows]
+            index.add(write_archive_file(directory, records), records)
+            db.session.execute(delete(SessionStep).where(SessionStep.session_id.in_(list(paths))))
+            if delete_rows:
+                db.session.execute(delete(s).where(s.id.in_([row.id for row in rows])))
+            db.session.commit()
+
+            last = (rows[-1].started_at, rows[-1].id)
+            total += len(rows)
+            print(f"✓ Archived {total} sessions")
+    finally:
+        index.close()
+    return total
+
+def apply_retention(directory, retention_days, chunk_size=1000, now=None):
+    """Archive and remove expired sessions: whole partitions if partitioned, else row chunks"""
+    cutoff = retention_cutoff(retention_days, now)
+    if not sessions_partitioned():
+        return archive_sessions(directory, cutoff, chunk_size)
+
+    ensure_partitions(now=now)
+    # Only months that ended before the cutoff; the rest wait for their partition to expire
+    expired = [(name, start, end) for name, start, end in list_partitions() if end <= cutoff]
+    if not expired:
+        return 0
+    end = expired[-1][2]
+    total = archive_sessions(directory, end, chunk_size, delete_rows=False)
+    for name, _, _ in expired:
+        db.session.execute(text(f'DROP TABLE {name}'))
+        db.session.commit()
+        print(f"✓ Dropped partition {name}")
+    # Stragglers in the default partition were archived above too
+    db.session.execute(delete(TroubleshootingSession).where(TroubleshootingSession.started_at < end))
+    db.session.commit()
+    return total
+
+# Postgres partitioning
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    return moment.replace(year=moment.year + month // 12, month=month % 12 + 1)
+
+def partition_name(start):
+    return f'{SESSIONS_TABLE}_p{start:%Y%m}'
+
+def sessions_partitioned():
+    """True if troubleshooting_sessions is a partitioned Postgres table"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))'
+    ), {'table': SESSIONS_TABLE}).scalar()
+
+def list_partitions():
+    """(name, start, end) of each monthly partition, oldest first"""
+    names = db.session.execute(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:table)'
+    ), {'table': SESSIONS_TABLE}).scalars()
+    prefix = f'{SESSIONS_TABLE}_p'
+    partitions = []
+    for name in names:
+        if name.startswith(prefix):
+            start = datetime.strptime(name[len(prefix):], '%Y%m')
+            partitions.append((name, start, add_months(start, 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+def _bounds(start):
+    return f"FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+
+def _in_month(start):
+    return f"started_at >= '{start.isoformat()}' AND started_at < '{add_months(start, 1).isoformat()}'"
+
+def create_partition(start):
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {SESSIONS_TABLE} "
+        f"FOR VALUES {_bounds(start)}"
+    ))
+
+def move_out_of_default(start):
+    """Create a month's partition from the rows the default partition holds for it"""
+    # Postgres refuses a partition whose range the default partition already has rows in,
+    # so the rows are copied into a plain table that is then attached in their place
+    name = partition_name(start)
+    db.session.execute(text(f'CREATE TABLE {name} (LIKE {SESSIONS_TABLE} INCLUDING DEFAULTS)'))
+    db.session.execute(text(f'INSERT INTO {name} SELECT * FROM {SESSIONS_TABLE}_default WHERE {_in_month(start)}'))
+    db.session.execute(text(f'DELETE FROM {SESSIONS_TABLE}_default WHERE {_in_month(start)}'))
+    db.session.execute(text(f'ALTER TABLE {SESSIONS_TABLE} ATTACH PARTITION {name} FOR VALUES {_bounds(start)}'))
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD, now=None):
+    """Create any missing partitions from the oldest session in the default partition to months_ahead
+
+    Sessions land in the default partition when their month has no partition
+    yet (e.g. this hasn't run for a while); they are moved into the new one.
+    """
+    existing = {name for name, _, _ in list_partitions()}
+    stragglers = db.session.execute(text(f'SELECT min(started_at) FROM {SESSIONS_TABLE}_default')).scalar()
+    current = month_start(now or datetime.utcnow())
+    start = min(month_start(stragglers), current) if stragglers else current
+    end = add_months(current, months_ahead)
+    while start <= end:
+        if partition_name(start) not in existing:
+            has_rows = db.session.execute(text(
+                f'SELECT EXISTS (SELECT 1 FROM {SESSIONS_TABLE}_default WHERE {_in_month(start)})'
+            )).scalar()
+            if has_rows:
+                move_out_of_default(start)
+            else:
+                create_partition(start)
+            # One month per transaction keeps the locks short
+            db.session.commit()
+            print(f"✓ Created partition {partition_name(start)}")
+        start = add_months(start, 1)
+
+def partition_sessions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Rebuild troubleshooting_sessions as a table partitioned by month on started_at"""
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Partitioning is only supported on Postgres')
+    if sessions_partitioned():
+        return False
+
+    old = f'{SESSIONS_TABLE}_unpartitioned'
+    sequence = db.session.execute(
+        text('SELECT pg_get_serial_sequence(:table, :column)'), {'table': SESSIONS_TABLE, 'column': 'id'}
+    ).scalar()
+    oldest = db.session.query(db.func.min(TroubleshootingSession.started_at)).scalar()
+
+    db.session.execute(text(f'ALTER TABLE {SESSIONS_TABLE} RENAME TO {old}'))
+    db.session.execute(text(
+        f'CREATE TABLE {SESSIONS_TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (started_at)'
+    ))
+    # Rows outside every monthly partition land here instead of failing the insert
+    db.session.execute(text(f'CREATE TABLE {SESSIONS_TABLE}_default PARTITION OF {SESSIONS_TABLE} DEFAULT'))
+    start = month_start(oldest or datetime.utcnow())
+    end = add_months(month_start(datetime.utcnow()), months_ahead)
+    while start <= end:
+        create_partition(start)
+        start = add_months(start, 1)
+
+    db.session.execute(text(f'INSERT INTO {SESSIONS_TABLE} SELECT * FROM {old}'))
+    # Keep the id sequence when the old table (which owns it) is dropped
+    db.session.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {SESSIONS_TABLE}.id'))
+    db.session.execute(text(f'DROP TABLE {old}'))
+
+    # Unique keys on a partitioned table must include started_at; telemetry
+    # deduplicates session starts on (session_id, started_at) once partitioned
+    db.session.execute(text(f'ALTER TABLE {SESSIONS_TABLE} ADD PRIMARY KEY (id, started_at)'))
+    db.session.execute(text(
+        f'CREATE UNIQUE INDEX uq_sessions_session_id_started_at ON {SESSIONS_TABLE} (session_id, started_at)'
+    ))
+    db.session.execute(text(f'CREATE INDEX ix_sessions_session_id ON {SESSIONS_TABLE} (session_id)'))
+    db.session.execute(text(f'CREATE INDEX ix_sessions_started_at ON {SESSIONS_TABLE} (started_at DESC)'))
+    db.session.execute(text(
+        f'CREATE INDEX ix_sessions_open_started ON {SESSIONS_TABLE} (completed_at, started_at) '
+        'WHERE abandoned = false'
+    ))
+    db.session.execute(text(f'CREATE INDEX ix_sessions_conclusion_id ON {SESSIONS_TABLE} (conclusion_id)'))
+    db.session.commit()
+    return True
+
+if __name__ == '__main__':
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'archive'
+    with app.app_context():
+        directory = app.config['SESSION_ARCHIVE_DIR']
+        if command == 'archive':
+            days = app.config['SESSION_RETENTION_DAYS']
+            print(f"Archiving sessions older than {days} days to {directory}...")
+            total = apply_retention(directory, days)
+            print(f"\n✅ Archived {total} sessions")
+        elif command == 'partition':
+            if db.engine.dialect.name != 'postgresql':
+                print("✗ Partitioning needs a Postgres database")
+                sys.exit(1)
+            print("Partitioning troubleshooting_sessions by month...")
+            if partition_sessions():
+                print("\n✅ troubleshooting_sessions is now partitioned by month")
+            else:
+                print("\n✅ troubleshooting_sessions was already partitioned")
+        elif command == 'partitions':
+            if not sessions_partitioned():
+                print("✗ troubleshooting_sessions is not partitioned")
+                sys.exit(1)
+            ensure_partitions()
+            print("\n✅ Partitions are in place")
+        elif command == 'find' and len(sys.argv) > 2:
+            found = find_archived_session(directory, sys.argv[2])
+            if found is None:
+                print(f"✗ {sys.argv[2]} is not in the archive")
+                sys.exit(1)
+            print(json.dumps(to_record(found), indent=2))
+        else:
+            print(__doc__)
+            sys.exit(2)
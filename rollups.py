@@ -0,0 +1,181 @@
+"""
+Pre-aggregated session analytics
+Session counts are rolled up per hour and per day x conclusion x first-level
+category (the answer given to the start question; none for sessions a search
+result opened further down the tree), so the analytics page reads O(days) rows
+instead of scanning every session.
+
+Every counter is bucketed by the session's started_at, completions and
+abandons included: a bucket describes the sessions started in it, so its
+completion rate can't exceed 100% and matches the duration percentiles, which
+select sessions by started_at too.
+
+Rollups are updated incrementally by the telemetry writer. Run this file to
+rebuild them from the raw troubleshooting_sessions table in chunks.
+"""
+
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, TroubleshootingSession, SessionRollup
+from session_steps import path_summaries
+
+GRAINS = ('hour', 'day')
+
+COUNTERS = (
+    'sessions_started',
+    'sessions_completed',
+    'sessions_abandoned',
+    'total_questions',
+    'total_duration_seconds'
+)
+
+def bucket_start(moment, grain):
+    """Truncate a timestamp to the start of its hour or day"""
+    if grain == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def category_of(path, entry_question=None):
+    """First-level category of a session: its answer to the start question"""
+    # Sessions opened on another question never answered start
+    if entry_question is None and path and isinstance(path[0], dict):
+        return (path[0].get('answer') or '')[:100]
+    return ''
+
+class RollupBatch:
+    """Rollup increments accumulated in memory and upserted in one statement"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, moment, category='', conclusion_id=0, **increments):
+        """Add counter increments to the hour and day buckets containing moment"""
+        for grain in GRAINS:
+            key = (grain, bucket_start(moment, grain), category, conclusion_id or 0)
+            row = self.rows.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            for name, value in increments.items():
+                row[name] += value
+
+    def add_started(self, started_at):
+        """Count a session start (bucketed by started_at)"""
+        self.add(started_at, sessions_started=1)
+
+    def add_completed(self, started_at, completed_at, category, questions, conclusion_id):
+        """Count a completed session (bucketed by started_at, like its start)"""
+        self.add(
+            started_at,
+            category=category[:100],
+            conclusion_id=conclusion_id,
+            sessions_completed=1,
+            total_questions=questions,
+            total_duration_seconds=(completed_at - started_at).total_seconds()
+        )
+
+    def add_abandoned(self, started_at):
+        """Count a session marked abandoned (bucketed by started_at)"""
+        self.add(started_at, sessions_abandoned=1)
+
+    def write(self):
+        """Upsert every accumulated row in the caller's transaction"""
+        if not self.rows:
+            return
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(SessionRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['grain', 'bucket', 'category', 'conclusion_id'],
+            set_={
+                name: getattr(SessionRollup, name) + getattr(stmt.excluded, name)
+                for name in COUNTERS
+            }
+        )
+        db.session.execute(stmt, [
+            dict(zip(('grain', 'bucket', 'category', 'conclusion_id'), key), **counters)
+            for key, counters in self.rows.items()
+        ])
+        self.rows = {}
+
+def record_events(starts, completes):
+    """Roll up a batch of telemetry start/complete rows
+
+    Call this before the completions are applied to the sessions table: only
+    sessions that are not yet completed are counted, so reloading a
+    conclusion page doesn't count the session twice.
+    """
+    batch = RollupBatch()
+    for row in starts:
+        batch.add_started(row['started_at'])
+
+    if completes:
+        # Durations need started_at, which only the sessions table knows
+        started = {row.session_id: row for row in db.session.query(
+            TroubleshootingSession.session_id,
+            TroubleshootingSession.started_at,
+            TroubleshootingSession.abandoned,
+            TroubleshootingSession.entry_question
+        ).filter(
+            TroubleshootingSession.session_id.in_([row['session_id'] for row in completes]),
+            TroubleshootingSession.completed_at.is_(None)
+        )}
+        for row in completes:
+            if row['session_id'] in started:
+                session_row = started.pop(row['session_id'])
+                if session_row.abandoned:
+                    # Finished after the sweeper gave up on it
+                    batch.add(session_row.started_at, sessions_abandoned=-1)
+                batch.add_completed(
+                    session_row.started_at,
+                    row['completed_at'],
+                    category_of(row['path'], session_row.entry_question),
+                    len(row['path'] or ()),
+                    row['conclusion_id']
+                )
+    batch.write()
+
+def rebuild_rollups(chunk_size=5000):
+    """Recompute rollups from the raw sessions table, one id range at a time"""
+    s = TroubleshootingSession
+    # Days before the oldest remaining session were archived by retention.py; keep their rollups
+    oldest = db.session.query(db.func.min(s.started_at)).scalar()
+    if oldest is None:
+        return 0
+    SessionRollup.query.filter(SessionRollup.bucket >= bucket_start(oldest, 'day')).delete()
+    db.session.commit()
+
+    last_id = 0
+    processed = 0
+    while True:
+        rows = db.session.query(
+            s.id, s.session_id, s.started_at, s.completed_at, s.conclusion_id, s.abandoned, s.entry_question
+        ).filter(s.id > last_id).order_by(s.id).limit(chunk_size).all()
+        if not rows:
+            break
+
+        summaries = path_summaries([row.session_id for row in rows if row.completed_at])
+        batch = RollupBatch()
+        for row in rows:
+            batch.add_started(row.started_at)
+            if row.completed_at:
+                questions, category = summaries.get(row.session_id, (0, ''))
+                if row.entry_question is not None:
+                    category = ''
+                batch.add_completed(row.started_at, row.completed_at, category, questions, row.conclusion_id)
+            if row.abandoned:
+                batch.add_abandoned(row.started_at)
+        batch.write()
+        db.session.commit()
+
+        last_id = rows[-1].id
+        processed += len(rows)
+        print(f"✓ Rolled up {processed} sessions")
+    return processed
+
+if __name__ == '__main__':
+    from app import app
+
+    print("Rebuilding session rollups...")
+    with app.app_context():
+        db.create_all()
+        total = rebuild_rollups()
+    print(f"\n✅ Rollups rebuilt from {total} sessions")
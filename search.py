@@ -0,0 +1,236 @@
+"""
+Full-text search over the decision tree
+Finds questions by words in their text, their answers or those answers'
+conclusions. On Postgres the lookup runs against to_tsvector GIN indexes
+(created by migration 0007_search_indexes), so stemming applies: "spinning"
+finds "spin". On SQLite an inverted token index is built in memory from the
+compiled tree, once per tree version; admin edits swap in a new tree and
+commit_tree_change() rebuilds the index straight away.
+
+A question matches when every term appears somewhere in it, its answers or
+their conclusions, so "brush not spinning" finds the question whose answers
+include "Brush" and "Not Spinning". The last word typed also matches as a
+prefix, so results appear while a technician is still typing. Each question is
+listed once, with the text that matched best.
+"""
+
+import heapq
+import math
+import re
+from bisect import bisect_left
+from collections import namedtuple
+from sqlalchemy import func, intersect, literal_column, select, union
+from models import db, Question, Answer, Conclusion
+
+SearchHit = namedtuple('SearchHit', ['question', 'field', 'text', 'rank'])
+
+# Matches in the question itself outrank matches in its answers
+FIELD_WEIGHTS = {'question': 1.0, 'answer': 0.6, 'conclusion': 0.4}
+
+DEFAULT_LIMIT = 25
+
+# Share of a full match given to a last word that only matched as a prefix
+PREFIX_WEIGHT = 0.25
+
+# Same expressions as the GIN indexes, or Postgres won't use them
+SEARCH_CONFIG = literal_column("'english'::regconfig")
+GIN_INDEXES = [
+    ('ix_questions_text_search', 'questions', "to_tsvector('english'::regconfig, text)"),
+    ('ix_answers_text_search', 'answers', "to_tsvector('english'::regconfig, text)"),
+    ('ix_conclusions_text_search', 'conclusions', "to_tsvector('english'::regconfig, text)"),
+]
+
+_TOKEN = re.compile(r'\w+')
+
+def tokenize(text):
+    """Lowercased word tokens of a text"""
+    return _TOKEN.findall(text.lower()) if text else []
+
+class SearchIndex:
+    """Inverted token index over one compiled tree
+
+    Postings are kept per question rather than per text, so requiring every
+    term is a set intersection of question keys, done in C, and only the
+    questions that make the result list are looked at in Python.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        # token -> {question pk: weighted share of the question's texts using it}
+        postings = {}
+        for question in tree.questions.values():
+            for field, text in searchable_texts(question):
+                tokens = set(tokenize(text))
+                if not tokens:
+                    continue
+                weight = FIELD_WEIGHTS[field] / math.sqrt(len(tokens))
+                for token in tokens:
+                    scores = postings.setdefault(token, {})
+                    scores[question.id] = scores.get(question.id, 0) + weight
+        self.postings = postings
+        # Sorted so every token sharing a prefix sits in one contiguous run
+        self.tokens = sorted(postings)
+
+    def _expand(self, prefix):
+        found = []
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            found.append(self.postings[self.tokens[i]])
+            i += 1
+        return found
+
+    def _idf(self, matches):
+        # Rare words count for more
+        return math.log(1 + len(self.tree) / matches)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Best hits for a query, every term required somewhere in each question"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        *whole, last = terms
+        postings = [self.postings.get(term) for term in whole]
+        expansions = self._expand(last)
+        if not expansions or any(p is None for p in postings):
+            return []
+
+        candidates = set(expansions[0]).union(*expansions[1:])
+        last_idf = self._idf(len(candidates))
+        for scores in sorted(postings, key=len):
+            candidates &= scores.keys()
+            if not candidates:
+                return []
+
+        weighted = [(scores, self._idf(len(scores))) for scores in postings]
+        exact = self.postings.get(last, {})
+
+        def rank(question_pk):
+            # A question reached only through a longer word counts for less
+            last_score = exact.get(question_pk, PREFIX_WEIGHT) * last_idf
+            return last_score + sum(scores[question_pk] * idf for scores, idf in weighted)
+
+        hits = []
+        for question_pk in heapq.nlargest(limit, candidates, key=rank):
+            question = self.tree.questions_by_pk[question_pk]
+            field, text = best_text(question, whole, last)
+            hits.append(SearchHit(question, field, text, rank(question_pk)))
+        return hits
+
+def searchable_texts(question):
+    """(field, text) pairs a question can be found by"""
+    yield 'question', question.text
+    for answer in question.answers:
+        yield 'answer', answer.text
+        if answer.conclusion:
+            yield 'conclusion', answer.conclusion
+
+def best_text(question, whole, last):
+    """The (field, text) of a question matching the most terms"""
+    def matched(item):
+        field, text = item
+        tokens = set(tokenize(text))
+        count = sum(term in tokens for term in whole) + any(t.startswith(last) for t in tokens)
+        return count, FIELD_WEIGHTS[field]
+    return max(searchable_texts(question), key=matched)
+
+def best_per_question(rows, limit):
+    """One SearchHit per question from (question, field, text, score) rows"""
+    best = {}
+    totals = {}
+    for question, field, text, score in rows:
+        totals[question.id] = totals.get(question.id, 0) + score
+        if question.id not in best or score > best[question.id][3]:
+            best[question.id] = (question, field, text, score)
+    # Ranked on everything that matched, shown with the best single match
+    hits = [SearchHit(question, field, text, totals[question.id]) for question, field, text, score in best.values()]
+    hits.sort(key=lambda hit: hit.rank, reverse=True)
+    return hits[:limit]
+
+def uses_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+def refresh(tree):
+    """Rebuild the in-memory index after an edit (Postgres keeps its own)"""
+    if not uses_postgres():
+        # Reading the cached property builds it
+        tree.search_index
+
+def _tsquery_terms(query):
+    """to_tsquery operands for a query, the last one as a prefix"""
+    # tokenize() leaves only word characters, so nothing here is tsquery syntax
+    terms = list(dict.fromkeys(tokenize(query)))
+    return terms[:-1] + [terms[-1] + ':*'] if terms else []
+
+def _postgres_search(tree, query, limit):
+    terms = _tsquery_terms(query)
+    if not terms:
+        return []
+    # Stop words ("not", "the") parse to an empty tsquery that matches nothing
+    lexemes = db.session.execute(select(*[
+        func.numnode(func.to_tsquery(SEARCH_CONFIG, term)) for term in terms
+    ])).one()
+    terms = [term for term, count in zip(terms, lexemes) if count]
+    if not terms:
+        return []
+    # Conclusions are shared between answers, so their matches are joined back to every answer using them
+    searches = [
+        ('question', Question.id, Question.text,
+         func.to_tsvector(SEARCH_CONFIG, Question.text), None),
+        ('answer', Answer.question_id, Answer.text,
+         func.to_tsvector(SEARCH_CONFIG, Answer.text), None),
+        ('conclusion', Answer.question_id, Conclusion.text,
+         func.to_tsvector(SEARCH_CONFIG, Conclusion.text), Conclusion.id == Answer.conclusion_id),
+    ]
+
+    def joined(query, join_on):
+        return query.select_from(Answer).join(Conclusion, join_on) if join_on is not None else query
+
+    def questions_matching(tsquery):
+        ts_query = func.to_tsquery(SEARCH_CONFIG, tsquery)
+        return union(*[
+            joined(select(question_pk), join_on).where(vector.op('@@')(ts_query))
+            for field, question_pk, text, vector, join_on in searches
+        ])
+
+    # Questions with every term somewhere in their text, answers or conclusions
+    per_term = [questions_matching(term) for term in terms]
+    matching = (intersect(*per_term) if len(per_term) > 1 else per_term[0]).subquery()
+    any_term = func.to_tsquery(SEARCH_CONFIG, ' | '.join(terms))
+
+    rows = []
+    for field, question_pk, text, vector, join_on in searches:
+        rank = func.ts_rank(vector, any_term)
+        matched = joined(db.session.query(question_pk, text, rank), join_on).filter(
+            question_pk.in_(select(matching)),
+            vector.op('@@')(any_term)
+        ).order_by(rank.desc()).limit(limit * 4)
+        for pk, matched_text, score in matched:
+            question = tree.questions_by_pk.get(pk)
+            # Rows committed after this worker's tree was built are skipped until it reloads
+            if question:
+                rows.append((question, field, matched_text, score * FIELD_WEIGHTS[field]))
+    return best_per_question(rows, limit)
+
+def search(tree, query, limit=DEFAULT_LIMIT):
+    """Ranked SearchHits for a query against the current tree"""
+    if uses_postgres():
+        return _postgres_search(tree, query, limit)
+    return tree.search_index.search(query, limit)
+
+if __name__ == '__main__':
+    import sys
+    import time
+    from app import app
+    from tree_cache import tree_cache
+
+    query = ' '.join(sys.argv[1:])
+    with app.app_context():
+        tree = tree_cache.get()
+        tree.search_index
+        started = time.perf_counter()
+        hits = search(tree, query)
+        elapsed = (time.perf_counter() - started) * 1000
+
+    for hit in hits:
+        print(f"✓ {hit.question.question_id} [{hit.field}] {hit.text[:70]} ({hit.rank:.3f})")
+    print(f"\n✅ {len(hits)} hit(s) for \"{query}\" in {elapsed:.1f} ms")
@@ -0,0 +1,185 @@
+"""
+Normalized session paths
+Each answered question of a session is one session_steps row holding the
+answer id and when it was answered, instead of a JSON copy of every question
+and answer text. Text is joined back from the tree when a path is read, so
+paths follow wording edits. Text is only stored for steps that can't be tied
+to an answer: text-only client paths, and answers that are later deleted.
+"""
+
+from sqlalchemy import func, null, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Question, Answer, TroubleshootingSession, SessionStep
+
+class PathResolver:
+    """Maps recorded {question, answer} steps onto the current tree
+
+    Steps recorded with an answer_id resolve directly. Older text-only steps
+    are matched against the answers of the question the path should be on,
+    then against any unambiguous (question text, answer text) pair. Steps
+    whose wording has since been edited stay unresolved and keep their text.
+    """
+
+    def __init__(self, tree):
+        self.tree = tree
+        by_text = {}
+        for answer in tree.answers.values():
+            question = tree.question_for_answer(answer)
+            by_text.setdefault((question.text, answer.text), []).append(answer)
+        self.by_text = {key: answers[0] for key, answers in by_text.items() if len(answers) == 1}
+
+    def resolve(self, path):
+        """Yield (step, answer or None) for each step of a recorded path"""
+        expected = self.tree.get_question('start')
+        for step in path:
+            answer = self._match(step, expected)
+            yield step, answer
+            if answer and answer.next_question_id:
+                expected = self.tree.get_question(answer.next_question_id)
+            else:
+                expected = None
+
+    def _match(self, step, expected):
+        answer = self.tree.get_answer(step.get('answer_id'))
+        if answer:
+            return answer
+        if expected:
+            for candidate in expected.answers:
+                if candidate.text == step.get('answer'):
+                    return candidate
+        return self.by_text.get((step.get('question'), step.get('answer')))
+
+def step_rows(session_id, path, answered_at=None, first_position=0):
+    """session_steps rows for a {question, answer[, answer_id][, at]} path starting at first_position"""
+    rows = []
+    for position, step in enumerate(path, first_position):
+        answer_id = step.get('answer_id')
+        has_id = isinstance(answer_id, int)
+        rows.append({
+            'session_id': session_id,
+            'position': position,
+            'answer_id': answer_id if has_id else None,
+            'question_text': None if has_id else step.get('question'),
+            'answer_text': None if has_id else step.get('answer'),
+            'answered_at': step.get('at') or answered_at
+        })
+    return rows
+
+def insert_steps(rows):
+    """Insert steps in the caller's transaction, keeping steps already recorded"""
+    if not rows:
+        return
+    # Every progress event repeats the path so far; only its new steps are stored
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    db.session.execute(
+        dialect.insert(SessionStep).on_conflict_do_nothing(index_elements=['session_id', 'position']),
+        rows
+    )
+
+def _step_json(step, tree, previous_at):
+    answer = tree.answers.get(step.answer_id) if step.answer_id is not None else None
+    seconds = None
+    if step.answered_at and previous_at:
+        seconds = (step.answered_at - previous_at).total_seconds()
+    return {
+        'question': tree.questions_by_pk[answer.question_id].text if answer else step.question_text or '',
+        'answer': answer.text if answer else step.answer_text or '',
+        'answer_id': step.answer_id,
+        'answered_at': step.answered_at,
+        'seconds': seconds
+    }
+
+def paths_for(sessions, tree):
+    """session_id -> list of step dicts for (session_id, started_at) pairs, in one query"""
+    started = dict(sessions)
+    paths = {}
+    previous = {}
+    steps = SessionStep.query.filter(
+        SessionStep.session_id.in_(list(started))
+    ).order_by(SessionStep.session_id, SessionStep.position)
+    for step in steps:
+        previous_at = previous.get(step.session_id, started[step.session_id])
+        paths.setdefault(step.session_id, []).append(_step_json(step, tree, previous_at))
+        previous[step.session_id] = step.answered_at
+    return paths
+
+def session_path(session_record, tree):
+    """Steps of one session with text and seconds spent on each question"""
+    path = paths_for([(session_record.session_id, session_record.started_at)], tree)
+    # Archived and not yet converted sessions still carry their path as JSON
+    return path.get(session_record.session_id) or session_record.path_taken or []
+
+def step_counts(session_ids):
+    """session_id -> number of questions answered, in one grouped query"""
+    return dict(db.session.query(
+        SessionStep.session_id, func.count()
+    ).filter(
+        SessionStep.session_id.in_(session_ids)
+    ).group_by(SessionStep.session_id))
+
+def path_summaries(session_ids):
+    """session_id -> (questions answered, answer to the start question) for rollup categories"""
+    first = dict(db.session.query(
+        SessionStep.session_id, func.coalesce(Answer.text, SessionStep.answer_text)
+    ).outerjoin(
+        Answer, Answer.id == SessionStep.answer_id
+    ).outerjoin(
+        Question, Question.id == Answer.question_id
+    ).filter(
+        SessionStep.session_id.in_(session_ids),
+        SessionStep.position == 0,
+        # A first step on another question came from a search result jump
+        db.or_(Answer.id.is_(None), Question.question_id == 'start')
+    ))
+    return {session_id: (count, first.get(session_id) or '') for session_id, count in step_counts(session_ids).items()}
+
+def preserve_answer_text(answer_ids):
+    """Copy question/answer text onto the steps of answers about to be deleted"""
+    if not answer_ids:
+        return
+    answer_text = select(Answer.text).where(Answer.id == SessionStep.answer_id).scalar_subquery()
+    question_text = select(Question.text).join(
+        Answer, Answer.question_id == Question.id
+    ).where(Answer.id == SessionStep.answer_id).scalar_subquery()
+    db.session.execute(
+        update(SessionStep)
+        .where(SessionStep.answer_id.in_(answer_ids), SessionStep.answer_text.is_(None))
+        .values(question_text=question_text, answer_text=answer_text)
+        .execution_options(synchronize_session=False)
+    )
+
+def convert_path_taken(tree, chunk_size=1000):
+    """Move JSON path_taken histories into session_steps, returning the sessions converted"""
+    s = TroubleshootingSession
+    resolver = PathResolver(tree)
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.query(s.id, s.session_id, s.path_taken).filter(
+            s.id > last_id,
+            s.path_taken.isnot(None)
+        ).order_by(s.id).limit(chunk_size).all()
+        if not rows:
+            break
+
+        steps = []
+        for row in rows:
+            path = row.path_taken if isinstance(row.path_taken, list) else []
+            resolved = []
+            for step, answer in resolver.resolve(step for step in path if isinstance(step, dict)):
+                if answer:
+                    resolved.append({'answer_id': answer.id})
+                else:
+                    resolved.append({'question': step.get('question') or '', 'answer': step.get('answer') or ''})
+            steps.extend(step_rows(row.session_id, resolved))
+        insert_steps(steps)
+        # SQL NULL rather than JSON null, so converted rows drop out of the filter above
+        db.session.execute(
+            update(s).where(s.id.in_([row.id for row in rows])).values(path_taken=null())
+        )
+        db.session.commit()
+
+        last_id = rows[-1].id
+        total += len(rows)
+        print(f"✓ Converted {total} session paths")
+    return total
@@ -0,0 +1,140 @@
+"""
+Warm start
+With WARM_START on, each worker does the work of its first requests while it
+boots: the decision tree is read from the snapshot file at TREE_SNAPSHOT_PATH
+instead of the database, stylesheets are fingerprinted, and Jinja templates
+are compiled, loading bytecode from TEMPLATE_CACHE_DIR when an earlier boot or
+the build step left it there. A background thread then checks the snapshot
+against the tree version in the database, which also opens the worker's first
+pooled connection, and reloads and rewrites it if an edit has landed since.
+
+Each phase is timed, logged and exported on /metrics. Templates are compiled
+most-visited first and compilation stops once COLD_START_BUDGET_MS is spent;
+the rest compile on first use as before.
+
+Run this file in the build step to write the bytecode cache and the snapshot:
+    python startup.py
+"""
+
+import os
+import threading
+import time
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import SQLAlchemyError
+from models import db
+from tree_cache import tree_cache, write_snapshot
+from assets import assets
+
+PHASES = ['tree', 'assets', 'templates', 'total']
+
+# Pages technicians land on right after a restart compile first
+TEMPLATE_PRIORITY = ['question.html', 'conclusion.html', 'index.html', 'search.html', 'offline.html']
+
+class Startup:
+    """Times and bounds the warm-up each worker does at boot"""
+
+    def __init__(self):
+        self.enabled = False
+        self.snapshot_path = None
+        self.budget_seconds = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.deferred_templates = 0
+
+    def init_app(self, app):
+        """Read the warm start settings and attach the template bytecode cache"""
+        self.enabled = app.config.get('WARM_START', False)
+        self.snapshot_path = app.config.get('TREE_SNAPSHOT_PATH')
+        self.budget_seconds = app.config.get('COLD_START_BUDGET_MS', 0) / 1000
+        if self.enabled:
+            attach_bytecode_cache(app)
+
+    def warm(self, app):
+        """Run every phase now, returning the seconds spent"""
+        started = time.perf_counter()
+        with app.app_context():
+            from_snapshot = self._timed('tree', self._load_tree, app)
+            self._timed('assets', assets.load_all)
+            compiled = self._timed('templates', self._compile_templates, app, started)
+        self.phases['total'] = time.perf_counter() - started
+
+        app.logger.info(
+            'Warm start in %.0f ms (tree %.0f ms%s, assets %.0f ms, %s templates %.0f ms)',
+            self.phases['total'] * 1000, self.phases['tree'] * 1000,
+            ' from snapshot' if from_snapshot else '', self.phases['assets'] * 1000,
+            compiled, self.phases['templates'] * 1000
+        )
+        if self.deferred_templates:
+            app.logger.warning('Cold start budget of %.0f ms spent, %s templates left to compile on first use',
+                               self.budget_seconds * 1000, self.deferred_templates)
+        if from_snapshot:
+            threading.Thread(target=self._verify, args=(app,), name='tree-snapshot-check', daemon=True).start()
+        return self.phases['total']
+
+    def _timed(self, phase, work, *args):
+        started = time.perf_counter()
+        try:
+            return work(*args)
+        finally:
+            self.phases[phase] = time.perf_counter() - started
+
+    def _load_tree(self, app):
+        if self.snapshot_path and tree_cache.load_snapshot(self.snapshot_path) is not None:
+            return True
+        # No usable snapshot: load from the database now and leave one for the next boot
+        try:
+            tree = tree_cache.refresh()
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception('Tree not preloaded; it will load on the first request')
+            return False
+        if self.snapshot_path:
+            try:
+                write_snapshot(tree, self.snapshot_path)
+            except OSError:
+                app.logger.exception('Could not write tree snapshot %s', self.snapshot_path)
+        return False
+
+    def _compile_templates(self, app, started):
+        names = app.jinja_env.list_templates()
+        ordered = [n for n in TEMPLATE_PRIORITY if n in names] + sorted(set(names) - set(TEMPLATE_PRIORITY))
+        for position, name in enumerate(ordered):
+            if self.budget_seconds and time.perf_counter() - started >= self.budget_seconds:
+                self.deferred_templates = len(ordered) - position
+                return position
+            app.jinja_env.get_template(name)
+        return len(ordered)
+
+    def _verify(self, app):
+        with app.app_context():
+            try:
+                if tree_cache.verify_snapshot(self.snapshot_path):
+                    app.logger.info('Tree snapshot was stale; reloaded version %s', tree_cache.get().version)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Tree snapshot check failed')
+
+def attach_bytecode_cache(app):
+    """Keep compiled templates in TEMPLATE_CACHE_DIR so other workers and later boots reuse them"""
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+startup = Startup()
+
+if __name__ == '__main__':
+    from app import app
+
+    print("Preparing warm start files...")
+    attach_bytecode_cache(app)
+    # Templates already compiled in memory at import would skip the bytecode cache
+    app.jinja_env.cache.clear()
+    with app.app_context():
+        names = app.jinja_env.list_templates()
+        for name in names:
+            app.jinja_env.get_template(name)
+        print(f"✓ Compiled {len(names)} templates into {app.config['TEMPLATE_CACHE_DIR']}")
+        tree = tree_cache.refresh()
+        write_snapshot(tree, app.config['TREE_SNAPSHOT_PATH'])
+        print(f"✓ Wrote tree version {tree.version} ({len(tree)} questions) to {app.config['TREE_SNAPSHOT_PATH']}")
+    print("\n✅ Warm start files ready; set WARM_START=true to use them")
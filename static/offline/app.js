@@ -0,0 +1,257 @@
+// Offline troubleshooting client
+// Walks the tree bundle from /offline/manifest.json entirely in the browser and
+// queues finished (or abandoned) sessions in localStorage until they can be
+// uploaded to /api/sessions/sync - one request per session instead of per step.
+(function () {
+    'use strict';
+
+    var QUEUE_KEY = 'troubleshooting.pendingSessions';
+    var REJECTED_KEY = 'troubleshooting.rejectedSessions';
+    var CURRENT_KEY = 'troubleshooting.currentSession';
+    var SYNC_URL = '/api/sessions/sync';
+    var SYNC_BATCH = 500;
+    // Failed uploads wait 5 s, doubling up to 10 minutes
+    var RETRY_BASE_MS = 5000;
+    var RETRY_MAX_MS = 600000;
+
+    var tree = null;
+    var current = null;
+    var syncing = false;
+    var batchSize = SYNC_BATCH;
+    var failures = 0;
+    var retryTimer = null;
+
+    function el(tag, className, text) {
+        var node = document.createElement(tag);
+        if (className) node.className = className;
+        if (text !== undefined) node.textContent = text;
+        return node;
+    }
+
+    function read(key, fallback) {
+        try {
+            return JSON.parse(localStorage.getItem(key)) || fallback;
+        } catch (e) {
+            return fallback;
+        }
+    }
+
+    function write(key, value) {
+        localStorage.setItem(key, JSON.stringify(value));
+    }
+
+    function newSessionId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    // Telemetry queue
+
+    function enqueue(session) {
+        var queue = read(QUEUE_KEY, []).filter(function (s) {
+            return s.session_id !== session.session_id;
+        });
+        queue.push({
+            session_id: session.session_id,
+            started_at: session.started_at,
+            completed_at: session.completed_at || null,
+            conclusion: session.conclusion || null,
+            path: session.path
+        });
+        write(QUEUE_KEY, queue);
+        sync();
+    }
+
+    function dequeue(batch, key) {
+        var sent = {};
+        batch.forEach(function (s) { sent[s.session_id] = true; });
+        write(QUEUE_KEY, read(QUEUE_KEY, []).filter(function (s) {
+            return !sent[s.session_id];
+        }));
+        if (key) write(key, read(key, []).concat(batch));
+    }
+
+    function retryLater() {
+        failures += 1;
+        var delay = Math.min(RETRY_MAX_MS, RETRY_BASE_MS * Math.pow(2, failures - 1));
+        clearTimeout(retryTimer);
+        retryTimer = setTimeout(sync, delay);
+    }
+
+    function sync() {
+        var batch = read(QUEUE_KEY, []).slice(0, batchSize);
+        renderStatus();
+        if (syncing || !batch.length || !navigator.onLine) return;
+        syncing = true;
+        clearTimeout(retryTimer);
+        fetch(SYNC_URL, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({sessions: batch})
+        }).then(function (response) {
+            if (response.ok) {
+                dequeue(batch);
+                batchSize = SYNC_BATCH;
+                failures = 0;
+                return true;
+            }
+            if (response.status === 400 || response.status === 413) {
+                // The server refuses the whole batch over one bad session: halve the
+                // batch until that session is alone, then set it aside for good
+                if (batch.length > 1) {
+                    batchSize = Math.ceil(batch.length / 2);
+                } else {
+                    dequeue(batch, REJECTED_KEY);
+                    batchSize = SYNC_BATCH;
+                }
+                return true;
+            }
+            throw new Error('sync failed: ' + response.status);
+        }).catch(function () {
+            // Offline, or the server is struggling; back off before trying again
+            retryLater();
+            return false;
+        }).then(function (progressed) {
+            syncing = false;
+            renderStatus();
+            if (progressed) sync();
+        });
+    }
+
+    // Walking the tree
+
+    function start() {
+        if (current && !current.completed_at && current.path.length) {
+            // Keep abandoned sessions so the dashboard can see where they stopped
+            enqueue(current);
+        }
+        current = {
+            session_id: newSessionId(),
+            started_at: new Date().toISOString(),
+            question: tree.start,
+            path: []
+        };
+        write(CURRENT_KEY, current);
+        render();
+    }
+
+    function choose(question, answer) {
+        var step = {question: question.text, answer: answer.text, at: new Date().toISOString()};
+        if (answer.id !== null) step.answer_id = answer.id;
+        current.path.push(step);
+
+        if (answer.next && tree.questions[answer.next]) {
+            current.question = answer.next;
+        } else if (answer.conclusion) {
+            current.completed_at = new Date().toISOString();
+            current.conclusion = answer.conclusion;
+            enqueue(current);
+        } else {
+            current.error = 'Configuration error: answer has no next step';
+        }
+        write(CURRENT_KEY, current);
+        render();
+    }
+
+    // Rendering
+
+    function renderStatus() {
+        var pending = read(QUEUE_KEY, []).length;
+        var status = document.getElementById('status');
+        status.textContent = (navigator.onLine ? 'Online' : 'Offline') +
+            (pending ? ' · ' + pending + ' session(s) waiting to upload' : '');
+    }
+
+    function renderHistory(container) {
+        if (!current.path.length) return;
+        var card = el('div', 'history-card');
+        card.appendChild(el('h3', null, '📋 Your Path'));
+        current.path.forEach(function (step) {
+            var item = el('div', 'history-item');
+            item.appendChild(el('div', 'history-question', step.question));
+            item.appendChild(el('div', 'history-answer', '→ ' + step.answer));
+            card.appendChild(item);
+        });
+        var restart = el('button', 'restart-btn', '↻ Start Over');
+        restart.onclick = start;
+        card.appendChild(restart);
+        container.appendChild(card);
+    }
+
+    function render() {
+        var app = document.getElementById('app');
+        app.textContent = '';
+        var card = el('div', 'question-card');
+        app.appendChild(card);
+
+        if (current.error) {
+            card.appendChild(el('div', 'flash error', current.error));
+            var again = el('button', 'submit-btn', 'Start Over');
+            again.onclick = start;
+            card.appendChild(again);
+        } else if (current.completed_at) {
+            card.appendChild(el('div', 'success-icon', '✅'));
+            card.appendChild(el('h2', null, 'Diagnosis Complete'));
+            card.appendChild(el('div', 'conclusion-text', current.conclusion));
+            var next = el('button', 'submit-btn', 'Start New Diagnosis');
+            next.onclick = start;
+            card.appendChild(next);
+        } else {
+            var question = tree.questions[current.question];
+            card.appendChild(el('div', 'progress', 'Question ' + (current.path.length + 1)));
+            card.appendChild(el('h2', null, question.text));
+            var answers = el('div', 'answers');
+            question.answers.forEach(function (answer) {
+                var button = el('button', 'answer-btn', answer.text);
+                button.onclick = function () { choose(question, answer); };
+                answers.appendChild(button);
+            });
+            card.appendChild(answers);
+        }
+        renderHistory(app);
+    }
+
+    function showError(message) {
+        var app = document.getElementById('app');
+        app.textContent = '';
+        app.appendChild(el('div', 'flash error', message));
+    }
+
+    // Startup
+
+    function loadTree() {
+        return fetch('manifest.json', {cache: 'no-cache'}).then(function (response) {
+            if (!response.ok) throw new Error('manifest ' + response.status);
+            return response.json();
+        }).then(function (manifest) {
+            return fetch(manifest.tree);
+        }).then(function (response) {
+            if (!response.ok) throw new Error('tree ' + response.status);
+            return response.json();
+        });
+    }
+
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/offline/sw.js');
+    }
+    window.addEventListener('online', function () {
+        failures = 0;
+        sync();
+    });
+    window.addEventListener('offline', renderStatus);
+
+    loadTree().then(function (loaded) {
+        tree = loaded;
+        current = read(CURRENT_KEY, null);
+        // Resume an unfinished session unless the tree changed underneath it
+        if (current && !current.completed_at && !current.error && tree.questions[current.question]) {
+            render();
+        } else {
+            current = null;
+            start();
+        }
+        sync();
+    }).catch(function () {
+        showError('The troubleshooting guide has not been downloaded yet. Open this page once while connected.');
+    });
+})();
@@ -0,0 +1,72 @@
+// Service worker for the offline client
+// Keeps the page, script, manifest and current tree bundle cached so the tree
+// can be walked with no connection. Tree files are named after their content
+// hash, so they are cached forever and superseded ones are dropped.
+var CACHE = 'troubleshooting-offline-v1';
+var SHELL = ['/offline/', '/offline/manifest.json', '/static/offline/app.js'];
+var TREE_FILE = /^\/offline\/tree\.[0-9a-f]+\.json$/;
+
+self.addEventListener('install', function (event) {
+    event.waitUntil(caches.open(CACHE).then(function (cache) {
+        return cache.addAll(SHELL);
+    }).then(function () {
+        return self.skipWaiting();
+    }));
+});
+
+self.addEventListener('activate', function (event) {
+    event.waitUntil(caches.keys().then(function (keys) {
+        return Promise.all(keys.filter(function (key) {
+            return key !== CACHE;
+        }).map(function (key) {
+            return caches.delete(key);
+        }));
+    }).then(function () {
+        return self.clients.claim();
+    }));
+});
+
+function cacheTree(cache, request, response) {
+    return cache.keys().then(function (keys) {
+        return Promise.all(keys.filter(function (key) {
+            return TREE_FILE.test(new URL(key.url).pathname) && key.url !== request.url;
+        }).map(function (key) {
+            return cache.delete(key);
+        }));
+    }).then(function () {
+        return cache.put(request, response);
+    });
+}
+
+self.addEventListener('fetch', function (event) {
+    var request = event.request;
+    var url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (TREE_FILE.test(url.pathname)) {
+        // Cache first: a given tree file never changes
+        event.respondWith(caches.open(CACHE).then(function (cache) {
+            return cache.match(request).then(function (cached) {
+                return cached || fetch(request).then(function (response) {
+                    if (response.ok) {
+                        event.waitUntil(cacheTree(cache, request, response.clone()));
+                    }
+                    return response;
+                });
+            });
+        }));
+    } else if (SHELL.indexOf(url.pathname) !== -1) {
+        // Network first so edits arrive while online, cached copy when not
+        event.respondWith(fetch(request).then(function (response) {
+            if (response.ok) {
+                var copy = response.clone();
+                event.waitUntil(caches.open(CACHE).then(function (cache) {
+                    return cache.put(request, copy);
+                }));
+            }
+            return response;
+        }).catch(function () {
+            return caches.match(request, {ignoreSearch: true});
+        }));
+    }
+});
@@ -0,0 +1,77 @@
+"""
+Abandoned-session sweeper
+Marks sessions that never reached a conclusion as abandoned once they have been
+idle for ABANDONED_AFTER_MINUTES: no answer recorded in session_steps (or, with
+no answers, no start) since then. A session's last activity is never earlier
+than its start, so candidates are found through the partial
+(completed_at, started_at) index and each chunk is a short UPDATE over primary
+keys; a sweep never holds long locks or scans the whole sessions table.
+
+Run this file to sweep once (e.g. from cron), or set
+ABANDONED_SWEEP_INTERVAL_SECONDS to sweep from a background thread.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import exists, update
+from models import db, TroubleshootingSession, SessionStep
+from rollups import RollupBatch
+
+def sweep_abandoned(idle_minutes=60, chunk_size=1000, now=None):
+    """Mark idle unfinished sessions as abandoned, returning how many were marked"""
+    s = TroubleshootingSession
+    cutoff = (now or datetime.utcnow()) - timedelta(minutes=idle_minutes)
+    # Still answering: a step recorded since the cutoff (looked up by the steps primary key)
+    active = exists().where(SessionStep.session_id == s.session_id, SessionStep.answered_at >= cutoff)
+    total = 0
+    while True:
+        ids = [row.id for row in db.session.query(s.id).filter(
+            s.completed_at.is_(None),
+            s.abandoned == False,  # noqa: E712 - must match the partial index predicate
+            s.started_at < cutoff,
+            ~active
+        ).order_by(s.started_at).limit(chunk_size)]
+        if not ids:
+            break
+
+        # Re-check: a session may have finished or moved on since the SELECT
+        marked = db.session.execute(
+            update(s)
+            .where(s.id.in_(ids), s.completed_at.is_(None), s.abandoned == False, ~active)  # noqa: E712
+            .values(abandoned=True)
+            .returning(s.started_at)
+        ).all()
+
+        batch = RollupBatch()
+        for (started_at,) in marked:
+            batch.add_abandoned(started_at)
+        batch.write()
+        db.session.commit()
+        total += len(marked)
+    return total
+
+def start_background_sweeper(app, interval_seconds, idle_minutes):
+    """Sweep every interval_seconds from a daemon thread"""
+    def run():
+        stop = threading.Event()
+        while not stop.wait(interval_seconds):
+            with app.app_context():
+                try:
+                    marked = sweep_abandoned(idle_minutes)
+                    if marked:
+                        app.logger.info('Marked %s sessions as abandoned', marked)
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception('Abandoned-session sweep failed')
+
+    thread = threading.Thread(target=run, name='abandoned-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+if __name__ == '__main__':
+    from app import app
+
+    print("Sweeping abandoned sessions...")
+    with app.app_context():
+        marked = sweep_abandoned(app.config['ABANDONED_AFTER_MINUTES'])
+    print(f"\n✅ Marked {marked} sessions as abandoned")
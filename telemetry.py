@@ -0,0 +1,229 @@
+"""
+Write-behind session telemetry
+Session start/progress/complete events are queued in-process and written to the database
+in batches by a background thread, keeping database round trips off the
+technician-facing request path.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import update, bindparam, values, column, String, DateTime, Integer
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, TroubleshootingSession
+import retention
+import rollups
+import session_steps
+
+# At most one queue-full warning per this many seconds; the dropped counter has the total
+DROP_WARNING_INTERVAL = 60
+
+class TelemetryWriter:
+    """Bounded queue of session events flushed in bulk by a background thread"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.dropped = 0
+        self.written = 0
+        self._warned_at = None
+        self._queue = queue.Queue(maxsize=10000)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._session_key = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Read queue settings from the app config"""
+        self.app = app
+        self.enabled = app.config.get('TELEMETRY_ASYNC', True)
+        self.batch_size = app.config.get('TELEMETRY_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('TELEMETRY_FLUSH_SECONDS', self.flush_interval)
+        self._queue = queue.Queue(maxsize=app.config.get('TELEMETRY_QUEUE_SIZE', 10000))
+        atexit.register(self.stop)
+
+    def session_started(self, session_id, started_at, ip_address, user_agent, entry_question=None):
+        """Record a new troubleshooting session (entry_question if it didn't open on start)"""
+        self._put(('start', {
+            'session_id': session_id,
+            'started_at': started_at,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'entry_question': entry_question,
+            'abandoned': False
+        }))
+
+    def session_completed(self, session_id, completed_at, path, conclusion_id):
+        """Record the path and conclusion of a finished session"""
+        self._put(('complete', {
+            'session_id': session_id,
+            'completed_at': completed_at,
+            'path': path,
+            'conclusion_id': conclusion_id
+        }))
+
+    def session_progress(self, session_id, path, first_position=0):
+        """Record steps of the path from first_position on, so abandoned sessions show where they stopped"""
+        self._put(('progress', {
+            'session_id': session_id,
+            'at': datetime.utcnow(),
+            'path': path,
+            'first_position': first_position
+        }))
+
+    def _put(self, event):
+        if not self.enabled:
+            self._write([event])
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            now = time.monotonic()
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+                # The queue fills under heavy load, when a warning per event would flood the log
+                warn = self._warned_at is None or now - self._warned_at >= DROP_WARNING_INTERVAL
+                if warn:
+                    self._warned_at = now
+            if warn:
+                self.app.logger.warning('Telemetry queue full, %d events dropped so far', dropped)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._take_batch(timeout=self.flush_interval)
+            if batch:
+                self._write(batch)
+
+    def _take_batch(self, timeout=None):
+        """Wait for one event, then drain up to batch_size without blocking"""
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """Synchronously write everything still queued"""
+        while True:
+            batch = self._take_batch(timeout=0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self):
+        """Stop the writer thread and flush remaining events (runs at exit)"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        if self.app is not None:
+            self.flush()
+
+    def _write(self, events):
+        with self.app.app_context():
+            try:
+                self._apply(events)
+                db.session.commit()
+                with self._lock:
+                    self.written += len(events)
+                return
+            except SQLAlchemyError:
+                db.session.rollback()
+                if len(events) == 1:
+                    with self._lock:
+                        self.dropped += 1
+                    self.app.logger.exception('Failed to write telemetry event')
+                    return
+        # Retry one at a time so a single bad row doesn't cost the whole batch
+        for event in events:
+            self._write([event])
+
+    def _apply(self, events):
+        # Starts go first so a session started and finished within one batch exists to update
+        starts = [row for kind, row in events if kind == 'start']
+        completes = [row for kind, row in events if kind == 'complete']
+        progress = [row for kind, row in events if kind == 'progress']
+        if starts:
+            starts = self._insert_new_sessions(starts)
+        # Roll up before the UPDATE so already-completed sessions can be skipped
+        rollups.record_events(starts, completes)
+        if completes:
+            self._update_sessions(
+                completes,
+                {'completed_at': DateTime, 'conclusion_id': Integer},
+                abandoned=False
+            )
+
+        # Steps not given their own time were answered just before the event was queued
+        steps = {}
+        for row in progress + completes:
+            answered_at = row.get('at') or row['completed_at']
+            steps_from = row.get('first_position', 0)
+            for step in session_steps.step_rows(row['session_id'], row['path'] or [], answered_at, steps_from):
+                steps.setdefault((step['session_id'], step['position']), step)
+        session_steps.insert_steps(list(steps.values()))
+
+    def _insert_new_sessions(self, starts):
+        """Insert session rows, skipping ids that already exist; returns the rows inserted"""
+        # API clients may report the same session start more than once
+        dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+        if self._session_key is None:
+            # A partitioned sessions table (retention.py) can only be unique with started_at
+            self._session_key = ['session_id', 'started_at'] if retention.sessions_partitioned() else ['session_id']
+        inserted = set(db.session.execute(
+            dialect.insert(TroubleshootingSession)
+            .on_conflict_do_nothing(index_elements=self._session_key)
+            .returning(TroubleshootingSession.session_id),
+            starts
+        ).scalars())
+        return [row for row in starts if row['session_id'] in inserted]
+
+    def _update_sessions(self, rows, types, *criteria, **fixed):
+        """UPDATE troubleshooting_sessions from dicts keyed by session_id"""
+        table = TroubleshootingSession.__table__
+        names = list(types)
+        if db.engine.dialect.name == 'postgresql':
+            # One UPDATE ... FROM (VALUES ...) statement for the whole batch
+            data = values(
+                column('session_id', String),
+                *[column(name, types[name]) for name in names],
+                name='v'
+            ).data([
+                tuple(r[name] for name in ['session_id'] + names)
+                for r in rows
+            ])
+            db.session.execute(
+                update(table)
+                .where(table.c.session_id == data.c.session_id, *criteria)
+                .values(**{name: data.c[name] for name in names}, **fixed)
+            )
+        else:
+            # SQLite has no VALUES column aliases, so fall back to executemany
+            db.session.execute(
+                update(table)
+                .where(table.c.session_id == bindparam('b_session_id'), *criteria)
+                .values(**{name: bindparam('b_' + name, type_=types[name]) for name in names}, **fixed),
+                [{'b_' + name: r[name] for name in ['session_id'] + names} for r in rows]
+            )
+
+telemetry = TelemetryWriter()
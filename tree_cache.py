@@ -0,0 +1,248 @@
+"""
+In-process compiled decision tree
+The whole Question/Answer graph is loaded once per worker and served from memory.
+Every edit bumps a version row, which workers poll to notice edits made elsewhere.
+
+A worker can also start from a snapshot file of the tree (written by
+startup.py) instead of the database; it is then checked against the version
+row in the background and replaced if an edit has landed since it was written.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from functools import cached_property
+from types import MappingProxyType
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Question, Answer, TreeVersion
+
+CompiledAnswer = namedtuple(
+    'CompiledAnswer',
+    ['id', 'question_id', 'text', 'next_question_id', 'conclusion_id', 'conclusion', 'order']
+)
+
+CompiledQuestion = namedtuple(
+    'CompiledQuestion',
+    ['id', 'question_id', 'text', 'category', 'answers']
+)
+
+class CompiledTree:
+    """Immutable snapshot of every question and its ordered answers"""
+
+    def __init__(self, questions, version=0):
+        self.version = version
+        self.questions = MappingProxyType({q.question_id: q for q in questions})
+        self.questions_by_pk = MappingProxyType({q.id: q for q in questions})
+        self.answers = MappingProxyType({a.id: a for q in questions for a in q.answers})
+        self.conclusions = MappingProxyType({
+            a.conclusion_id: a.conclusion for a in self.answers.values() if a.conclusion_id
+        })
+        self.conclusion_ids = MappingProxyType({text: id for id, text in self.conclusions.items()})
+
+    def __len__(self):
+        return len(self.questions)
+
+    @cached_property
+    def ordered_questions(self):
+        """Questions sorted by question_id, built once per tree for the admin pickers"""
+        return tuple(sorted(self.questions.values(), key=lambda q: q.question_id))
+
+    # api, bundle and search import this module, so they are imported on first use
+
+    @cached_property
+    def document(self):
+        """/api/tree body and its ETag, serialized once per tree"""
+        from api import dumps, content_hash, tree_json
+        body = dumps(tree_json(self))
+        return body, content_hash(body)
+
+    @cached_property
+    def offline_bundle(self):
+        """The same body precompressed for the offline client"""
+        from bundle import bundle_of
+        body, digest = self.document
+        return bundle_of(self.version, body, digest)
+
+    @cached_property
+    def search_index(self):
+        """In-memory search index, used on SQLite (Postgres searches its own indexes)"""
+        from search import SearchIndex
+        return SearchIndex(self)
+
+    def get_question(self, question_id):
+        """Look up a question by its string question_id"""
+        return self.questions.get(question_id)
+
+    def get_answer(self, answer_id):
+        """Look up an answer by primary key (accepts form strings)"""
+        try:
+            return self.answers.get(int(answer_id))
+        except (TypeError, ValueError):
+            return None
+
+    def question_for_answer(self, answer):
+        """Question an answer belongs to"""
+        return self.questions_by_pk.get(answer.question_id)
+
+    def history_for(self, answer_ids):
+        """Rebuild {question, answer} text pairs from a list of answer ids"""
+        history = []
+        for answer_id in answer_ids:
+            answer = self.answers.get(answer_id)
+            # Answers deleted mid-session simply drop out of the history
+            if answer:
+                history.append({
+                    'question': self.questions_by_pk[answer.question_id].text,
+                    'answer': answer.text,
+                    'answer_id': answer.id
+                })
+        return history
+
+def current_version():
+    """Read the tree version counter (0 before the first edit)"""
+    return db.session.query(TreeVersion.version).filter_by(id=1).scalar() or 0
+
+def bump_version():
+    """Increment the tree version in the caller's transaction"""
+    updated = TreeVersion.query.filter_by(id=1).update(
+        {TreeVersion.version: TreeVersion.version + 1},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(TreeVersion(id=1, version=1))
+
+def load_tree():
+    """Build a CompiledTree from the database in three queries"""
+    # Read the version first: if an edit lands mid-load we end up with newer rows
+    # under an older version, which only costs one extra reload later
+    version = current_version()
+    
+    answers_by_question = {}
+    answer_rows = Answer.query.order_by(Answer.question_id, Answer.order, Answer.id).all()
+    for a in answer_rows:
+        answers_by_question.setdefault(a.question_id, []).append(CompiledAnswer(
+            id=a.id,
+            question_id=a.question_id,
+            text=a.text,
+            next_question_id=a.next_question_id,
+            conclusion_id=a.conclusion_id,
+            conclusion=a.conclusion.text if a.conclusion else None,
+            order=a.order
+        ))
+
+    questions = [
+        CompiledQuestion(
+            id=q.id,
+            question_id=q.question_id,
+            text=q.text,
+            category=q.category,
+            answers=tuple(answers_by_question.get(q.id, ()))
+        )
+        for q in Question.query.all()
+    ]
+    return CompiledTree(questions, version)
+
+def write_snapshot(tree, path):
+    """Save a tree as JSON, replacing any older snapshot in one step"""
+    document = {
+        'version': tree.version,
+        'question_fields': CompiledQuestion._fields,
+        'answer_fields': CompiledAnswer._fields,
+        'questions': [q._replace(answers=[list(a) for a in q.answers]) for q in tree.questions.values()]
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Workers may write at the same time; each renames its own temporary file into place
+    partial = f'{path}.{os.getpid()}.tmp'
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump(document, f, separators=(',', ':'), ensure_ascii=False)
+    os.replace(partial, path)
+
+def read_snapshot(path):
+    """Tree from a snapshot file, or None if it is missing or from another code version"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (document.get('question_fields') != list(CompiledQuestion._fields)
+            or document.get('answer_fields') != list(CompiledAnswer._fields)):
+        return None
+    questions = []
+    for row in document['questions']:
+        question = CompiledQuestion(*row)
+        questions.append(question._replace(answers=tuple(CompiledAnswer(*a) for a in question.answers)))
+    return CompiledTree(questions, document['version'])
+
+class TreeCache:
+    """Holds the current CompiledTree and swaps it atomically on refresh"""
+
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._tree = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the version polling interval from the app config"""
+        self.check_interval = app.config.get('TREE_VERSION_CHECK_SECONDS', self.check_interval)
+
+    def get(self):
+        """Current tree, building it on first use and reloading it when the version moves"""
+        tree = self._tree
+        if tree is None:
+            with self._lock:
+                if self._tree is None:
+                    self._publish(load_tree())
+                tree = self._tree
+        elif time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            if self._read_version(tree.version) != tree.version:
+                tree = self.refresh()
+        return tree
+
+    def refresh(self):
+        """Rebuild the tree from the database and swap it in"""
+        with self._lock:
+            # Build completely before publishing so readers never see a partial tree
+            tree = load_tree()
+            self._publish(tree)
+        return tree
+
+    def load_snapshot(self, path):
+        """Serve the tree from a snapshot file until the database is checked, or None"""
+        tree = read_snapshot(path)
+        if tree is not None:
+            with self._lock:
+                if self._tree is None:
+                    self._publish(tree)
+        return tree
+
+    def verify_snapshot(self, path):
+        """Reload and rewrite the snapshot if the database tree has moved on since it was written"""
+        tree = self._tree
+        if tree is None or self._read_version(tree.version) == tree.version:
+            return False
+        write_snapshot(self.refresh(), path)
+        return True
+
+    def _publish(self, tree):
+        self._tree = tree
+        self._checked_at = time.monotonic()
+
+    def _read_version(self, fallback):
+        # A failed poll keeps serving the tree we already have
+        try:
+            return current_version()
+        except SQLAlchemyError:
+            db.session.rollback()
+            return fallback
+
+    def clear(self):
+        """Drop the cached tree; the next get() reloads it"""
+        self._tree = None
+
+tree_cache = TreeCache()
@@ -0,0 +1,281 @@
+"""
+Decision tree import/export
+Importing compares a decision_tree.yaml file with the database and applies only
+the question/answer inserts, updates and deletes needed to match it, in bulk and
+in one transaction. Unchanged rows are untouched and edited rows keep their
+primary keys, so recorded session paths stay meaningful.
+
+Exporting streams the database tree back out in decision_tree.yaml format,
+then reads the file back to check that it would import unchanged.
+
+Usage:
+    python tree_sync.py import [decision_tree.yaml]
+    python tree_sync.py export [decision_tree.yaml]
+"""
+
+import json
+import re
+import sys
+from functools import lru_cache
+import yaml
+from sqlalchemy import insert, update, delete
+from models import db, Question, Answer, Conclusion
+from session_steps import preserve_answer_text
+import conclusions
+from tree_cache import bump_version
+
+ANSWER_FIELDS = ('text', 'next_question_id', 'conclusion', 'order')
+
+# libyaml's parser is an order of magnitude faster on large trees when available
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def _check_id(value, where):
+    # Unquoted 101, yes or 1.5 load as a number or bool; matching them against
+    # the database would delete and re-add the question under a new primary key
+    if not isinstance(value, str):
+        raise ValueError(f'{where} is {value!r}, not a string; put it in quotes in the YAML file')
+
+def load_yaml(path):
+    """Questions mapping from a decision tree YAML file, with every id checked to be a string"""
+    with open(path, 'r') as f:
+        data = yaml.load(f, Loader=SafeLoader) or {}
+    questions = data.get('questions') or {}
+    for q_id, q_data in questions.items():
+        _check_id(q_id, 'A question id')
+        for answer in q_data.get('answers') or []:
+            if answer.get('next') is not None:
+                _check_id(answer['next'], f'The next: of an answer to "{q_id}"')
+    return questions
+
+def _wanted_answers(q_data):
+    return [
+        {
+            'text': a['text'],
+            'next_question_id': a.get('next'),
+            'conclusion': a.get('conclusion'),
+            'order': idx + 1
+        }
+        for idx, a in enumerate(q_data.get('answers') or [])
+    ]
+
+def _match_answers(existing, wanted):
+    """Pair existing answer rows with wanted answers: same text first, then by position"""
+    pairs = []
+    unmatched = list(existing)
+    leftover = []
+    for answer in wanted:
+        match = next((row for row in unmatched if row['text'] == answer['text']), None)
+        if match:
+            unmatched.remove(match)
+            pairs.append((match, answer))
+        else:
+            leftover.append(answer)
+    # Edited wording reuses the remaining rows in display order
+    for row, answer in zip(unmatched, leftover):
+        pairs.append((row, answer))
+    return pairs, leftover[len(unmatched):], unmatched[len(leftover):]
+
+def plan_sync(questions_data):
+    """Work out the minimal changes that make the database match questions_data"""
+    current = {
+        row.question_id: row
+        for row in db.session.query(Question.id, Question.question_id, Question.text, Question.category)
+    }
+    answers_by_question = {}
+    for row in db.session.query(
+        Answer.id, Answer.question_id, Answer.text, Answer.next_question_id,
+        Conclusion.text.label('conclusion'), Answer.order
+    ).outerjoin(
+        Conclusion, Conclusion.id == Answer.conclusion_id
+    ).order_by(Answer.question_id, Answer.order, Answer.id):
+        answers_by_question.setdefault(row.question_id, []).append(row._asdict())
+
+    plan = {
+        'question_inserts': [],
+        'question_updates': [],
+        'question_deletes': [],
+        'answer_inserts': [],  # question_id here is the string id; resolved after insert
+        'answer_updates': [],
+        'answer_deletes': []
+    }
+
+    for q_id, q_data in questions_data.items():
+        row = current.get(q_id)
+        wanted = _wanted_answers(q_data)
+        if row is None:
+            plan['question_inserts'].append({
+                'question_id': q_id,
+                'text': q_data['text'],
+                'category': q_data.get('category', '')
+            })
+            plan['answer_inserts'].extend(dict(a, question_id=q_id) for a in wanted)
+            continue
+
+        # Category is optional in the YAML; leave the database value alone if it's absent
+        category = q_data.get('category', row.category)
+        if row.text != q_data['text'] or row.category != category:
+            plan['question_updates'].append({'id': row.id, 'text': q_data['text'], 'category': category})
+
+        pairs, inserts, deletes = _match_answers(answers_by_question.get(row.id, []), wanted)
+        for existing, answer in pairs:
+            if any(existing[field] != answer[field] for field in ANSWER_FIELDS):
+                plan['answer_updates'].append(dict(answer, id=existing['id']))
+        plan['answer_inserts'].extend(dict(a, question_id=q_id) for a in inserts)
+        plan['answer_deletes'].extend(existing['id'] for existing in deletes)
+
+    for q_id, row in current.items():
+        if q_id not in questions_data:
+            plan['question_deletes'].append(row.id)
+            plan['answer_deletes'].extend(a['id'] for a in answers_by_question.get(row.id, []))
+    return plan
+
+def apply_sync(plan):
+    """Apply a plan from plan_sync() with bulk statements in one transaction"""
+    if plan['answer_deletes']:
+        # Sessions that used these answers keep their text
+        preserve_answer_text(plan['answer_deletes'])
+        db.session.execute(delete(Answer).where(Answer.id.in_(plan['answer_deletes'])))
+    if plan['question_deletes']:
+        db.session.execute(delete(Question).where(Question.id.in_(plan['question_deletes'])))
+    if plan['question_updates']:
+        db.session.execute(update(Question), plan['question_updates'])
+
+    pk_by_question_id = dict(db.session.query(Question.question_id, Question.id))
+    if plan['question_inserts']:
+        inserted = db.session.execute(
+            insert(Question).returning(Question.question_id, Question.id),
+            plan['question_inserts']
+        )
+        pk_by_question_id.update((row.question_id, row.id) for row in inserted)
+
+    # Answers name their conclusion by id; texts seen for the first time get a row
+    conclusion_ids = conclusions.ids_for({
+        a['conclusion'] for a in plan['answer_updates'] + plan['answer_inserts'] if a['conclusion']
+    })
+
+    def answer_row(answer, **values):
+        row = {k: v for k, v in answer.items() if k != 'conclusion'}
+        return dict(row, conclusion_id=conclusion_ids.get(answer['conclusion']), **values)
+
+    if plan['answer_updates']:
+        db.session.execute(update(Answer), [answer_row(a) for a in plan['answer_updates']])
+    if plan['answer_inserts']:
+        db.session.execute(insert(Answer), [
+            answer_row(a, question_id=pk_by_question_id[a['question_id']])
+            for a in plan['answer_inserts']
+        ])
+
+    if any(plan.values()):
+        # Running workers reload the tree on their next version check
+        bump_version()
+        # Batch edits from editors opened before the import are refused rather than undoing it
+        db.session.execute(update(Question).values(version=Question.version + 1))
+    db.session.commit()
+
+def import_yaml(path='decision_tree.yaml'):
+    """Sync the database with a YAML file, returning the applied plan"""
+    plan = plan_sync(load_yaml(path))
+    apply_sync(plan)
+    return plan
+
+_PLAIN = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*$')
+
+@lru_cache(maxsize=None)
+def _loads_as_itself(value):
+    # Words like no, null or 1.5 would come back as a bool, None or a number
+    return yaml.load(value, Loader=SafeLoader) == value
+
+def _scalar(value, quote=True):
+    if not quote and _PLAIN.match(value) and _loads_as_itself(value):
+        return value
+    # JSON strings are valid YAML double-quoted scalars
+    return json.dumps(value, ensure_ascii=False)
+
+def _tree_rows(chunk_size=1000):
+    """Every question joined to its answers in display order, one row per answer"""
+    return db.session.query(
+        Question.id, Question.question_id, Question.text, Question.category,
+        Answer.id.label('answer_id'), Answer.text.label('answer_text'),
+        Answer.next_question_id, Conclusion.text.label('conclusion')
+    ).outerjoin(
+        Answer, Answer.question_id == Question.id
+    ).outerjoin(
+        Conclusion, Conclusion.id == Answer.conclusion_id
+    ).order_by(
+        Question.id, Answer.order, Answer.id
+    ).execution_options(yield_per=chunk_size)
+
+def export_yaml(path='decision_tree.yaml', chunk_size=1000):
+    """Stream the database tree to a YAML file, returning the question count"""
+    count = 0
+    current = None
+    with open(path, 'w') as f:
+        f.write('questions:\n')
+        for row in _tree_rows(chunk_size):
+            if row.id != current:
+                if current is not None:
+                    f.write('\n')
+                current = row.id
+                count += 1
+                f.write(f'  {_scalar(row.question_id, quote=False)}:\n')
+                f.write(f'    text: {_scalar(row.text)}\n')
+                if row.category:
+                    f.write(f'    category: {_scalar(row.category)}\n')
+                f.write('    answers:\n' if row.answer_id is not None else '    answers: []\n')
+            if row.answer_id is None:
+                continue
+            f.write(f'      - text: {_scalar(row.answer_text)}\n')
+            if row.next_question_id:
+                f.write(f'        next: {_scalar(row.next_question_id, quote=False)}\n')
+            if row.conclusion:
+                f.write(f'        conclusion: {_scalar(row.conclusion)}\n')
+    return count
+
+def _comparable(text, category, answers):
+    return (text, category or '', [(a['text'], a.get('next') or None, a.get('conclusion') or None) for a in answers])
+
+def check_export(path='decision_tree.yaml'):
+    """Question ids that don't load back from an exported file as the database has them"""
+    expected = {}
+    for row in _tree_rows():
+        question = expected.setdefault(row.question_id, (row.text, row.category, []))
+        if row.answer_id is not None:
+            question[2].append({'text': row.answer_text, 'next': row.next_question_id, 'conclusion': row.conclusion})
+    expected = {q_id: _comparable(*question) for q_id, question in expected.items()}
+    loaded = {
+        q_id: _comparable(q.get('text'), q.get('category'), q.get('answers') or [])
+        for q_id, q in load_yaml(path).items()
+    }
+    return sorted(
+        {str(q_id) for q_id in expected.keys() ^ loaded.keys()}
+        | {q_id for q_id in expected.keys() & loaded.keys() if expected[q_id] != loaded[q_id]}
+    )
+
+if __name__ == '__main__':
+    from app import app
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    path = sys.argv[2] if len(sys.argv) > 2 else 'decision_tree.yaml'
+    with app.app_context():
+        if command == 'import':
+            try:
+                plan = import_yaml(path)
+            except ValueError as e:
+                print(f"✗ {e}")
+                sys.exit(1)
+            print(f"✓ Questions: {len(plan['question_inserts'])} added, "
+                  f"{len(plan['question_updates'])} updated, {len(plan['question_deletes'])} deleted")
+            print(f"✓ Answers: {len(plan['answer_inserts'])} added, "
+                  f"{len(plan['answer_updates'])} updated, {len(plan['answer_deletes'])} deleted")
+            print(f"\n✅ Database synced with {path}")
+        elif command == 'export':
+            count = export_yaml(path)
+            # Reading the file back catches anything that wouldn't import as it was exported
+            problems = check_export(path)
+            if problems:
+                print(f"✗ {len(problems)} question(s) don't read back as exported: {', '.join(problems[:10])}")
+                sys.exit(1)
+            print(f"\n✅ Exported {count} questions to {path}")
+        else:
+            print(__doc__)
+            sys.exit(2)
@@ -0,0 +1,280 @@
+"""
+Decision tree validation
+Checks the compiled Question/Answer graph for answers leading to a missing
+question, answers with neither a next question nor a conclusion, questions that
+can't be reached from start, and loops. Each check is linear in the size of the
+tree; after an edit only the part of the graph the edit touched is re-checked.
+
+Loops are reported as warnings: linking back to an earlier question is allowed.
+
+Run this file to validate the database tree from the command line.
+"""
+
+import sys
+import threading
+from collections import namedtuple
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Longest loop spelled out in full in an issue message
+LOOP_PREVIEW = 5
+
+Issue = namedtuple(
+    'Issue',
+    ['severity', 'kind', 'question_id', 'question_pk', 'answer_id', 'message']
+)
+
+TreeReport = namedtuple('TreeReport', ['version', 'questions', 'issues', 'errors', 'warnings'])
+
+def _successors(tree, question_id, within=None):
+    """Distinct existing questions the answers of question_id lead to"""
+    targets = []
+    for answer in tree.questions[question_id].answers:
+        target = answer.next_question_id
+        if target and target in tree.questions and target not in targets:
+            if within is None or target in within:
+                targets.append(target)
+    return targets
+
+def question_issues(tree, question):
+    """Problems with a single question and its own answers"""
+    issues = []
+    if not question.answers:
+        issues.append(Issue(
+            WARNING, 'no_answers', question.question_id, question.id, None,
+            f'Question "{question.question_id}" has no answers'
+        ))
+    for answer in question.answers:
+        if answer.next_question_id:
+            if answer.next_question_id not in tree.questions:
+                issues.append(Issue(
+                    ERROR, 'dangling_next', question.question_id, question.id, answer.id,
+                    f'Answer "{answer.text}" leads to missing question "{answer.next_question_id}"'
+                ))
+        elif not answer.conclusion:
+            issues.append(Issue(
+                ERROR, 'dead_end', question.question_id, question.id, answer.id,
+                f'Answer "{answer.text}" has neither a next question nor a conclusion'
+            ))
+    return issues
+
+def reachable_from(tree, roots, seen=None):
+    """Questions reachable from roots, added to seen (depth-first, iterative)"""
+    seen = set() if seen is None else seen
+    stack = [root for root in roots if root in tree.questions and root not in seen]
+    seen.update(stack)
+    while stack:
+        for target in _successors(tree, stack.pop()):
+            if target not in seen:
+                seen.add(target)
+                stack.append(target)
+    return seen
+
+def find_loops(tree, roots, within=None):
+    """Loops among the questions reachable from roots (Tarjan's SCC, iterative)
+
+    Returns (loops, visited): each loop is a frozenset of question_ids, and
+    visited is every question the search explored. With within, only edges
+    between questions in that set are followed.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    loops = []
+
+    for root in roots:
+        if root in index or root not in tree.questions:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(_successors(tree, root, within)))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(_successors(tree, child, within))))
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = set()
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.add(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in _successors(tree, node, within):
+                        loops.append(frozenset(component))
+    return loops, set(index)
+
+def _loop_issue(tree, loop):
+    members = sorted(loop)
+    shown = ', '.join(members[:LOOP_PREVIEW])
+    if len(members) > LOOP_PREVIEW:
+        shown += f' and {len(members) - LOOP_PREVIEW} more'
+    first = tree.questions[members[0]]
+    return Issue(
+        WARNING, 'loop', first.question_id, first.id, None,
+        f'Questions {shown} form a loop' if len(members) > 1
+        else f'Question "{first.question_id}" leads back to itself'
+    )
+
+class TreeValidator:
+    """Validation results for the latest tree checked, updated incrementally"""
+
+    def __init__(self):
+        self._tree = None
+        self._report = None
+        self._local = {}       # question_id -> issues with its own answers
+        self._referrers = {}   # next_question_id -> question_ids with an answer leading there
+        self._reachable = set()
+        self._loops = []
+        self._lock = threading.Lock()
+
+    def check(self, tree):
+        """Report for tree, re-checking only what changed since the previous tree"""
+        with self._lock:
+            if tree is not self._tree:
+                if self._tree is None:
+                    self._check_all(tree)
+                else:
+                    self._check_changes(self._tree, tree)
+                self._tree = tree
+                self._report = self._build_report(tree)
+            return self._report
+
+    def _check_all(self, tree):
+        self._local = {}
+        self._referrers = {}
+        for question in tree.questions.values():
+            self._local[question.question_id] = question_issues(tree, question)
+            self._add_referrals(question)
+        self._reachable = reachable_from(tree, ['start'])
+        self._loops, _ = find_loops(tree, sorted(tree.questions))
+
+    def _add_referrals(self, question):
+        for answer in question.answers:
+            if answer.next_question_id:
+                self._referrers.setdefault(answer.next_question_id, set()).add(question.question_id)
+
+    def _remove_referrals(self, question):
+        for answer in question.answers:
+            referrers = self._referrers.get(answer.next_question_id)
+            if referrers is not None:
+                referrers.discard(question.question_id)
+                if not referrers:
+                    del self._referrers[answer.next_question_id]
+
+    def _check_changes(self, old, new):
+        added = new.questions.keys() - old.questions.keys()
+        removed = old.questions.keys() - new.questions.keys()
+        changed = {
+            question_id for question_id in new.questions.keys() & old.questions.keys()
+            if new.questions[question_id] != old.questions[question_id]
+        }
+        if not (added or removed or changed):
+            return
+
+        # Referrers of added/removed questions gain or lose a dangling reference
+        affected = set(added) | changed
+        for question_id in added | removed:
+            affected |= self._referrers.get(question_id, set())
+
+        for question_id in removed | changed:
+            self._remove_referrals(old.questions[question_id])
+            self._local.pop(question_id, None)
+        for question_id in added | changed:
+            self._add_referrals(new.questions[question_id])
+        for question_id in affected:
+            if question_id in new.questions:
+                self._local[question_id] = question_issues(new, new.questions[question_id])
+
+        added_edges = set()
+        removed_edges = set()
+        for question_id in affected | removed:
+            before = set(_successors(old, question_id)) if question_id in old.questions else set()
+            after = set(_successors(new, question_id)) if question_id in new.questions else set()
+            added_edges.update((question_id, target) for target in after - before)
+            removed_edges.update((question_id, target) for target in before - after)
+
+        if 'start' in added | removed:
+            self._reachable = reachable_from(new, ['start'])
+            self._loops, _ = find_loops(new, sorted(new.questions))
+            return
+        self._update_reachable(new, removed, added_edges, removed_edges)
+        self._update_loops(new, removed, added_edges, removed_edges)
+
+    def _update_reachable(self, tree, removed, added_edges, removed_edges):
+        if removed & self._reachable or any(source in self._reachable for source, _ in removed_edges):
+            # Losing an edge inside the reachable part can orphan anything below it
+            self._reachable = reachable_from(tree, ['start'])
+            return
+        new_targets = [target for source, target in added_edges if source in self._reachable]
+        reachable_from(tree, new_targets, self._reachable)
+
+    def _update_loops(self, tree, removed, added_edges, removed_edges):
+        # Loops only split when they lose a member or an edge, and only along that edge
+        touched = removed | {source for source, _ in removed_edges}
+        loops = []
+        for loop in self._loops:
+            if loop & touched:
+                members = loop - removed
+                loops.extend(find_loops(tree, sorted(members), within=members)[0])
+            else:
+                loops.append(loop)
+
+        # Any new loop runs through an added edge, so it is found from that edge's target
+        if added_edges:
+            found, visited = find_loops(tree, sorted({target for _, target in added_edges}))
+            loops = found + [loop for loop in loops if not loop & visited]
+        self._loops = loops
+
+    def _build_report(self, tree):
+        issues = []
+        if 'start' not in tree.questions:
+            issues.append(Issue(ERROR, 'missing_start', None, None, None, 'There is no "start" question'))
+        for local in self._local.values():
+            issues.extend(local)
+        if 'start' in tree.questions:
+            for question_id in tree.questions.keys() - self._reachable:
+                question = tree.questions[question_id]
+                issues.append(Issue(
+                    WARNING, 'unreachable', question_id, question.id, None,
+                    f'Question "{question_id}" can\'t be reached from start'
+                ))
+        issues.extend(_loop_issue(tree, loop) for loop in self._loops)
+
+        issues.sort(key=lambda i: (i.severity != ERROR, i.question_id or '', i.kind))
+        errors = sum(1 for i in issues if i.severity == ERROR)
+        return TreeReport(tree.version, len(tree), issues, errors, len(issues) - errors)
+
+def validate_tree(tree):
+    """Full validation report for a compiled tree"""
+    return TreeValidator().check(tree)
+
+tree_validator = TreeValidator()
+
+if __name__ == '__main__':
+    from app import app
+    from tree_cache import load_tree
+
+    with app.app_context():
+        report = validate_tree(load_tree())
+    for issue in report.issues:
+        print(f"{'✗' if issue.severity == ERROR else '!'} {issue.message}")
+    if report.errors:
+        print(f"\n✗ {report.errors} error(s), {report.warnings} warning(s) in {report.questions} questions")
+        sys.exit(1)
+    print(f"\n✅ No errors in {report.questions} questions ({report.warnings} warning(s))")